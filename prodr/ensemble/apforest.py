@@ -1,15 +1,34 @@
-from concurrent.futures import ThreadPoolExecutor
+from typing import Literal
 
 import numpy as np
+import scipy.sparse as sp
 
 from .types import InsertionEvent, NodeSplitEvent
-from .components import Node, ProgressiveDataStorage
+from .utils import gather_leaf_candidates, pair_distances, select_top_k
+from .validators import check_feature_dim
+from .components import NormalStack, Node, ProgressiveDataStorage
 from .aptree import APTree
+from .process_forest import ReplayTree, TreeProcessPool
+from .thread_budget import ThreadBudget
 
 
 class APForest:
     """
     An ensemble of APTrees for clustering data points.
+
+    Incoming batches are projected onto the normals of all trees at once through
+    a `NormalStack`, and each tree receives a view on its own columns.
+
+    With `executor="process"` the trees are grown in `n_workers` worker processes
+    instead of a thread pool, so the Python parts of insertion and splitting run
+    in parallel. `trees` then holds mirrors that replay the leaf assignments and
+    splits computed by the workers. The storage is shared with the workers,
+    which map its rows instead of copying them. Call `close` to stop the
+    workers.
+
+    `n_jobs` is the total thread budget (see `ThreadBudget`). It is split between
+    trees processed concurrently on a persistent pool and BLAS / numba threads
+    within each tree, and it bounds the threads of the worker processes.
     """
 
     def __init__(
@@ -20,40 +39,223 @@ class APForest:
         leaf_max_size: int = 256,
         b_strategy: str = "default",
         seed: int = 42,
+        projection_cache: bool = False,
+        executor: Literal["thread", "process"] = "thread",
+        n_workers: int | None = None,
+        mp_context: str | None = None,
+        n_jobs: int | None = None,
+        normal_family: Literal["gaussian", "sparse"] = "gaussian",
     ) -> None:
         self.data = data
         self.n_trees = n_trees
         self.leaf_max_size = leaf_max_size
         self.b_strategy = b_strategy
         self.seed = seed
+        self.projection_cache = projection_cache
+        self.executor = executor
+        self.normal_family = normal_family
+        self.budget = ThreadBudget(n_jobs=n_jobs, n_tasks=n_trees)
 
-        self.trees: list[APTree] = [
-            APTree(
-                data=self.data,
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor: {executor}")
+
+        tree_kwargs = [
+            dict(
                 leaf_max_size=self.leaf_max_size,
                 b_strategy=self.b_strategy,
                 seed=self.seed + i,
+                projection_cache=self.projection_cache,
+                normal_family=self.normal_family,
             )
             for i in range(self.n_trees)
         ]
+        tree_class = ReplayTree if executor == "process" else APTree
+        self.trees: list[APTree] = [
+            tree_class(data=self.data, **kwargs) for kwargs in tree_kwargs
+        ]
+        self._normal_stack: NormalStack | None = None
+
+        self._pool: TreeProcessPool | None = None
+        if executor == "process":
+            self.data.share()
+            self._pool = TreeProcessPool(
+                tree_kwargs=tree_kwargs,
+                n_workers=n_workers or self.budget.tree_workers,
+                n_jobs=self.budget.n_jobs,
+                mp_context=mp_context,
+            )
 
     def insert(self, start_idx: int) -> list[list[InsertionEvent]]:
-        insertion_events = []
+        if self._pool is not None:
+            results = self._pool.insert(self.data, start_idx)
+            return [
+                tree.apply_insertion(start_idx, leaf_ids, normals)  # type: ignore
+                for tree, (leaf_ids, normals) in zip(self.trees, results)
+            ]
+
+        with self.budget.limit(self.budget.n_jobs):
+            projections = self._project(self.data[start_idx:])
+
+        return self.budget.map(
+            lambda t: self.trees[t].insert(
+                start_idx,
+                self._normal_stack.tree_projections(projections, t),  # type: ignore
+            ),
+            range(self.n_trees),
+        )
+
+    def split(
+        self, max_splits: int | None = None, time_budget: float | None = None
+    ) -> list[list[NodeSplitEvent]]:
+        """
+        Split the overflowing leaves of every tree.
+        Args:
+            max_splits (int | None): Maximum number of splits per tree.
+            time_budget (float | None): Time budget of the whole forest, in seconds.
+                It is shared evenly by the trees processed one after the other
+                by each worker.
+        """
+        if time_budget is not None:
+            n_workers = self._pool.n_workers if self._pool else self.budget.tree_workers
+            time_budget /= -(-self.n_trees // n_workers)
+
+        if self._pool is not None:
+            results = self._pool.split(self.data, max_splits, time_budget)
+            return [
+                tree.apply_splits(normals, plans)  # type: ignore
+                for tree, (normals, plans) in zip(self.trees, results)
+            ]
 
-        with ThreadPoolExecutor(max_workers=16) as executor:
-            insertion_events = list(
-                executor.map(lambda tree: tree.insert(start_idx), self.trees)
+        return self.budget.map(
+            lambda tree: tree.split(max_splits, time_budget), self.trees
+        )
+
+    @property
+    def n_pending_splits(self) -> int:
+        """
+        Number of overflowing leaves left over by a split budget, over all trees.
+        """
+        return sum(tree.n_pending_splits for tree in self.trees)
+
+    def query(
+        self, X: np.ndarray | sp.csr_array, k: int = 10, exact: bool = True
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate k nearest neighbours of a batch of points among the live data
+        points. Queries are routed to one leaf per tree, and the union of the
+        members of those leaves is ranked by exact Euclidean distance, or by the
+        number of trees sharing a leaf with the query when `exact` is False.
+        Args:
+            X (np.ndarray | sp.csr_array): Query points, shape (n_queries, n_features).
+            k (int): Number of neighbours per query.
+            exact (bool): Whether to rank the candidates by their distance.
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Ids of the neighbours and their distances
+            (or co-leaf counts), both of shape (n_queries, k). Queries with fewer
+            than k candidates are padded with id -1.
+        """
+        if k < 1:
+            raise ValueError("k must be a positive integer.")
+        if self.data.n_live == 0:
+            raise ValueError("No data available.")
+        if not sp.issparse(X):
+            X = np.atleast_2d(np.asarray(X))
+        check_feature_dim(X, self.data.n_features)  # type: ignore
+
+        n_queries = X.shape[0]
+        if n_queries == 0:
+            return np.empty((0, k), dtype=np.int64), np.empty(
+                (0, k), dtype=np.float64 if exact else np.int64
             )
 
-        return insertion_events
+        queries, candidates, counts = gather_leaf_candidates(
+            self.route(X), self.get_leaf_tables()
+        )
+        if exact:
+            unique_ids, positions = np.unique(candidates, return_inverse=True)
+            values = pair_distances(X, self.data[unique_ids], queries, positions)
+            scores = values
+        else:
+            values = counts
+            scores = -counts
+        rows, ranks, pairs = select_top_k(queries, candidates, scores, n_queries, k)
+
+        ids = np.full((n_queries, k), -1, dtype=np.int64)
+        ids[rows, ranks] = candidates[pairs]
+        neighbor_values = np.full(
+            (n_queries, k), np.inf if exact else 0, dtype=values.dtype
+        )
+        neighbor_values[rows, ranks] = values[pairs]
+
+        return ids, neighbor_values
+
+    def route(self, X: np.ndarray | sp.csr_array) -> np.ndarray:
+        """
+        Leaf id of data points in every tree, without inserting them. Only the
+        trees are read, so routing may run concurrently with other reads.
+        Args:
+            X (np.ndarray | sp.csr_array): Data points, shape (n_samples, n_features).
+        Returns:
+            np.ndarray: Leaf ids of shape (n_samples, n_trees).
+        """
+        leaf_ids = np.empty((X.shape[0], self.n_trees), dtype=np.int64)
+        for t, tree in enumerate(self.trees):
+            leaf_ids[:, t] = tree.route(X)
+
+        return leaf_ids
+
+    def _project(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Project a batch onto the normals of every tree with a single GEMM.
+        Normals appended by splits since the last batch are synced into the
+        stack first.
+        """
+        if self._normal_stack is None:
+            normals = self.trees[0].get_normals()
+            self._normal_stack = NormalStack(
+                n_trees=self.n_trees,
+                n_features=normals.shape[1],
+                dtype=normals.dtype,
+                sparse=sp.issparse(normals),
+            )
+
+        for t, tree in enumerate(self.trees):
+            self._normal_stack.sync(t, tree.get_normals())
+
+        return self._normal_stack.project(batch)
+
+    def evict(self, offset: int) -> None:
+        if self._pool is not None:
+            self._pool.evict(offset)
+        for tree in self.trees:
+            tree.evict(offset)
+
+    def close(self) -> None:
+        """
+        Stop the worker processes of the "process" executor and the thread pool.
+        """
+        if self._pool is not None:
+            self._pool.close()
+        self.budget.close()
 
-    def split(self) -> list[list[NodeSplitEvent]]:
-        split_events = []
+    def get_leaf_ids(self, start_idx: int, end_idx: int) -> np.ndarray:
+        """
+        Leaf ids of the data points with ids in [start_idx, end_idx) in every tree.
+        Args:
+            start_idx (int): Id of the first data point.
+            end_idx (int): Id past the last data point.
+        Returns:
+            np.ndarray: Leaf ids of shape (end_idx - start_idx, n_trees).
+        """
+        leaf_ids = np.empty((end_idx - start_idx, self.n_trees), dtype=np.int32)
+        for t, tree in enumerate(self.trees):
+            offset = tree.get_id_offset()
+            leaf_ids[:, t] = tree.get_leaf_ids()[start_idx - offset : end_idx - offset]
 
-        with ThreadPoolExecutor(max_workers=16) as executor:
-            split_events = list(executor.map(lambda tree: tree.split(), self.trees))
+        return leaf_ids
 
-        return split_events
+    def get_leaf_tables(self) -> list[list[Node | None]]:
+        return [tree.get_leaf_table() for tree in self.trees]
 
     def get_id_to_node_mappings(self) -> list[list[Node]]:
         id_to_node_mappings = [tree.get_id_to_node_mapping() for tree in self.trees]
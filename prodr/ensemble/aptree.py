@@ -1,20 +1,57 @@
+import time
 from collections import deque
+from typing import Literal
 
 import numpy as np
-
-from .components import Node, ProgressiveDataStorage
+import scipy.sparse as sp
+
+from .components import (
+    FlatTree,
+    Hyperplane,
+    Node,
+    ProgressiveDataStorage,
+    ProjectionCache,
+    QuantileSketch,
+)
 from .types import InsertionEvent, NodeSplitEvent
 from .utils import (
     generate_hyperplane,
     generate_normal,
     split_node,
-    # traverse_to_leaf,
+    stack_normals,
+    traverse_to_leaf_ids,
 )
 
+B_STRATEGIES = ("default", "euclidean", "cosine", "exact", "sampled", "sketch")
+
 
 class APTree:
     """
     Adaptive Progressive Tree for clustering high-dimensional streaming data
+
+    `b_strategy` selects how the offset of a split is chosen: "default" takes
+    the median of the leaf's projections ("euclidean" and "cosine" are kept as
+    aliases), "exact" the upper median via `np.partition`, "sampled" the median
+    of a bounded random sample, and "sketch" reads the median from a quantile
+    sketch kept per leaf. A sketch is fed with the projections of the points
+    inserted into its leaf; the children of a split are seeded from the
+    projection cache when it holds all of their projections. Leaves without a
+    sketch are split on their exact median, so the sketch never costs extra
+    row gathers.
+
+    Leaves that overflow while points are inserted are marked dirty, and
+    `split` only visits those, so its cost does not grow with the number of
+    leaves of the tree. A split budget leaves the remaining overflowing leaves
+    queued for the next call.
+
+    `normal_family` selects dense Gaussian normals ("gaussian") or very sparse
+    +-1 normals ("sparse"), kept as a CSR matrix so that projections only read
+    the nonzero coordinates of each normal.
+
+    `projection_cache` keeps the projections of every point in a
+    `ProjectionCache` of n_samples x depth values of the storage's
+    `compute_dtype`, so that splits gather one value per point instead of a row.
+    It costs more memory than the data for low-dimensional rows.
     """
 
     def __init__(
@@ -24,136 +61,456 @@ class APTree:
         leaf_max_size: int = 256,
         b_strategy: str = "default",
         seed: int = 42,
+        projection_cache: bool = False,
+        normal_family: Literal["gaussian", "sparse"] = "gaussian",
     ) -> None:
         self.data = data
         self.leaf_max_size = leaf_max_size
         self.b_strategy = b_strategy
         self.seed = seed
+        self.projection_cache = projection_cache
+        self.normal_family = normal_family
+        if b_strategy not in B_STRATEGIES:
+            raise ValueError(f"Unknown b_strategy: {b_strategy}")
+        if normal_family not in ("gaussian", "sparse"):
+            raise ValueError(f"Unknown normal_family: {normal_family}")
         self._rng = np.random.default_rng(self.seed)
 
         self._root: Node = Node(
-            indices=[],
+            indices=np.empty(0, dtype=np.int64),
             depth=0,
         )
-        self._leaf_nodes: deque[Node] = deque([self._root])
-        self._id_to_node: list[Node] = []
-
-        self.normals: np.ndarray = np.array([])
+        self._flat_tree = FlatTree(root=self._root)
+        # Leaves by id, in the order they were created. `_leaf_ranks` keeps that
+        # order for sorting the dirty leaves before splitting them.
+        self._leaf_nodes: dict[int, Node] = {}
+        self._leaf_ranks: dict[int, int] = {}
+        self._n_ranked: int = 0
+        self._dirty_leaves: set[int] = set()
+        self._add_leaf(self._flat_tree.get_node_id(self._root), self._root)
+        self._leaf_ids: np.ndarray = np.empty(0, dtype=np.int32)
+        self._leaf_id_buffer: np.ndarray = self._leaf_ids
+        self._leaf_id_head: int = 0
+        self._id_offset: int = 0
+        self._sketches: dict[int, QuantileSketch] = {}
+
+        self.normals: np.ndarray | sp.csr_array = np.array([])
+        self._projections: ProjectionCache | None = (
+            ProjectionCache(dtype=self.data.compute_dtype) if projection_cache else None
+        )
 
-    def _init_normal(self, n_features: int) -> None:
-        self.normals = generate_normal(n_features, self._rng).reshape(1, -1)
+    def get_normals(self) -> np.ndarray | sp.csr_array:
+        """
+        Normal vectors of the tree by depth, shape (depth, n_features). A CSR
+        matrix for the "sparse" normal family.
+        """
+        if self.normals.shape[0] == 0:
+            self._add_normal()
+        return self.normals
 
-    def insert(self, start_idx: int) -> list[InsertionEvent]:
+    def insert(
+        self, start_idx: int, projections: np.ndarray | None = None
+    ) -> list[InsertionEvent]:
         """
         Insert new data points into the tree.
         Args:
-            data (ProgressiveDataStorage): New data points to be inserted.
+            start_idx (int): Id of the first new data point.
+            projections (np.ndarray | None): Projections of the new data points onto
+                `get_normals()`, shape (n_samples, depth). Computed from the storage
+                when omitted.
         """
-        batch = self.data[start_idx:]
-        insertion_events = self._insert_batch(batch, start_idx)
+        if projections is None:
+            projections = self.data[start_idx:] @ self.get_normals().T
+            if sp.issparse(projections):
+                projections = projections.toarray()  # type: ignore
+        insertion_events = self._insert_batch(projections, start_idx)
 
         return insertion_events
 
-    def split(self) -> list[NodeSplitEvent]:
-        split_events = self._split_nodes()
+    def route(self, X: np.ndarray | sp.csr_array) -> np.ndarray:
+        """
+        Leaf id of data points, without inserting them. The tree is only read,
+        so routing may run concurrently with other reads.
+        Args:
+            X (np.ndarray | sp.csr_array): Data points, shape (n_samples, n_features).
+        """
+        projections = X @ self.normals.T
+        if sp.issparse(projections):
+            projections = projections.toarray()  # type: ignore
+        return traverse_to_leaf_ids(self._flat_tree, projections, parallel=False)
+
+    def split(
+        self, max_splits: int | None = None, time_budget: float | None = None
+    ) -> list[NodeSplitEvent]:
+        """
+        Split the overflowing leaves. Leaves left over once the budget is spent
+        stay queued for the next call.
+        Args:
+            max_splits (int | None): Maximum number of splits. None is unbounded.
+            time_budget (float | None): Seconds after which no further split is
+                started. At least one split is made per call.
+        """
+        deadline = (
+            time.perf_counter() + time_budget if time_budget is not None else None
+        )
+        split_events = self._split_nodes(max_splits, deadline)
 
         return split_events
 
-    def _insert_batch(self, batch: np.ndarray, start_idx: int) -> list[InsertionEvent]:
-        """"""
-        insertion_events: list[InsertionEvent] = []
+    @property
+    def n_pending_splits(self) -> int:
+        """
+        Number of leaves holding more than `leaf_max_size` data points that are
+        waiting for a split.
+        """
+        return sum(
+            self._leaf_nodes[leaf_id].size > self.leaf_max_size
+            for leaf_id in self._dirty_leaves
+        )
 
-        if self.normals.size == 0:
-            self._init_normal(self.data.n_features)  # type: ignore
+    def _insert_batch(
+        self, projections: np.ndarray, start_idx: int
+    ) -> list[InsertionEvent]:
+        """"""
+        if self._projections is not None:
+            self._projections.append(start_idx, projections)
+        leaf_ids = traverse_to_leaf_ids(self._flat_tree, projections, parallel=False)
 
-        projections = batch @ self.normals.T
-        for i in range(batch.shape[0]):
-            leaf_node = self._traverse_to_leaf(projections[i])
-            leaf_node.indices.append(start_idx + i)
-            insertion_events.append(
-                InsertionEvent(data_index=start_idx + i, node=leaf_node)
-            )
-            self._id_to_node.append(leaf_node)
-        return insertion_events
+        return self._assign_leaves(leaf_ids, start_idx, projections)
 
-    def _traverse_to_leaf(self, projection: np.ndarray) -> Node:
+    def _assign_leaves(
+        self,
+        leaf_ids: np.ndarray,
+        start_idx: int,
+        projections: np.ndarray | None = None,
+    ) -> list[InsertionEvent]:
         """
-        Traverse the tree to find the appropriate leaf node for a given data point.
+        Add new data points to the leaves they were routed to.
         Args:
-            projection (np.ndarray): The projection of the data point onto the normal vectors.
+            leaf_ids (np.ndarray): Leaf id of every new data point.
+            start_idx (int): Id of the first new data point.
+            projections (np.ndarray | None): Projections of the new data points,
+                needed to update the quantile sketches of the "sketch" strategy.
         Returns:
-            Node: The leaf node where the data point should be inserted.
+            list[InsertionEvent]: One event per leaf reached, with the ids it
+            received.
         """
-        node = self._root
-        while not node.is_leaf:
-            offset = node.hyperplane.offset
-            node = node.left if projection[node.depth] >= offset else node.right
-
-        return node
+        insertion_events: list[InsertionEvent] = []
+        n_samples = leaf_ids.shape[0]
+
+        if self._leaf_ids.shape[0] == 0:
+            self._id_offset = start_idx
+
+        id_to_node = self._flat_tree.id_to_node
+        data_ids = np.arange(start_idx, start_idx + n_samples, dtype=np.int64)
+
+        order = np.argsort(leaf_ids, kind="stable")
+        unique_leaf_ids, group_starts = np.unique(leaf_ids[order], return_index=True)
+        for leaf_id, group in zip(
+            unique_leaf_ids.tolist(), np.split(data_ids[order], group_starts[1:])
+        ):
+            node: Node = id_to_node[leaf_id]  # type: ignore
+            if self.b_strategy == "sketch" and projections is not None:
+                self._update_sketch(leaf_id, node, projections[group - start_idx])
+            node.add_indices(group)
+            if node.size > self.leaf_max_size:
+                self._dirty_leaves.add(leaf_id)
+            insertion_events.append(InsertionEvent(data_indices=group, node=node))
+
+        self._append_leaf_ids(leaf_ids)
+        return insertion_events
 
-    def _split_nodes(self) -> list[NodeSplitEvent]:
+    def _append_leaf_ids(self, leaf_ids: np.ndarray) -> None:
+        """
+        Append the leaf ids of newly inserted data points. `_leaf_ids` is a view
+        on a buffer with spare capacity; evicted entries at its head are
+        reclaimed when the buffer runs out of room.
         """
-        Split a leaf node into two child nodes based on a hyperplane.
+        head = self._leaf_id_head
+        n = self._leaf_ids.shape[0]
+        m = n + leaf_ids.shape[0]
+
+        buffer = self._leaf_id_buffer
+        if head + m > buffer.shape[0]:
+            if 2 * m > buffer.shape[0]:
+                buffer = np.empty(max(2 * m, 1024), dtype=np.int32)
+            buffer[:n] = self._leaf_ids
+            self._leaf_id_buffer = buffer
+            head = self._leaf_id_head = 0
+
+        buffer[head + n : head + m] = leaf_ids
+        self._leaf_ids = buffer[head : head + m]
+
+    def _add_leaf(self, leaf_id: int, node: Node) -> None:
+        self._leaf_nodes[leaf_id] = node
+        self._leaf_ranks[leaf_id] = self._n_ranked
+        self._n_ranked += 1
+
+    def _remove_leaf(self, leaf_id: int) -> None:
+        del self._leaf_nodes[leaf_id]
+        del self._leaf_ranks[leaf_id]
+        self._dirty_leaves.discard(leaf_id)
+
+    def _split_nodes(
+        self, max_splits: int | None = None, deadline: float | None = None
+    ) -> list[NodeSplitEvent]:
+        """
+        Split the dirty leaves, and their children in turn, until no leaf holds
+        more than `leaf_max_size` data points or the budget is spent. Leaves are
+        split in the order they were created, children after every leaf of the
+        previous level.
         Args:
-            node (Node): The leaf node to be split.
+            max_splits (int | None): Maximum number of splits.
+            deadline (float | None): `time.perf_counter()` value after which no
+                further split is started.
         """
-
-        leaf_nodes: list[Node] = []
         split_events: list[NodeSplitEvent] = []
 
-        while self._leaf_nodes:
-            node = self._leaf_nodes.popleft()
-            if len(node.indices) <= self.leaf_max_size:
-                leaf_nodes.append(node)
+        queue = deque(sorted(self._dirty_leaves, key=self._leaf_ranks.__getitem__))
+        self._dirty_leaves = set()
+        while queue:
+            leaf_id = queue.popleft()
+            node = self._leaf_nodes[leaf_id]
+            if node.size <= self.leaf_max_size:
                 continue
+            if (max_splits is not None and len(split_events) >= max_splits) or (
+                deadline is not None
+                and split_events
+                and time.perf_counter() >= deadline
+            ):
+                self._dirty_leaves.add(leaf_id)
+                self._dirty_leaves.update(queue)
+                break
 
-            data = self.data[node.indices]
-            normal_vector = (
-                self.normals[node.depth] if node.depth < self.normals.shape[0] else None
-            )
-            hyperplane = generate_hyperplane(
-                data=data, normal_vector=normal_vector, rng=self._rng
-            )
-            if normal_vector is None:
-                self.normals = np.vstack([self.normals, hyperplane.normal])
+            hyperplane, mask = self._plan_split(node)
 
-            idx_arr = np.array(node.indices)
-            mask = np.dot(data, hyperplane.normal) >= hyperplane.offset
+            idx_arr = node.indices
 
             left_idx = idx_arr[mask]
             right_idx = idx_arr[np.logical_not(mask)]
 
             left_node, right_node = split_node(
                 node=node,
-                left=left_idx.tolist(),
-                right=right_idx.tolist(),
+                left=left_idx,
+                right=right_idx,
                 hyperplane=hyperplane,
             )
+            left_id, right_id = self._flat_tree.split_node(
+                node, left_node, right_node, hyperplane.offset
+            )
 
-            self._leaf_nodes.append(left_node)
-            self._leaf_nodes.append(right_node)
+            self._remove_leaf(leaf_id)
+            self._add_leaf(left_id, left_node)
+            self._add_leaf(right_id, right_node)
+            queue.extend((left_id, right_id))
 
-            for idx in left_idx:
-                self._id_to_node[idx] = left_node
+            self._leaf_ids[left_idx - self._id_offset] = left_id
+            self._leaf_ids[right_idx - self._id_offset] = right_id
 
-            for idx in right_idx:
-                self._id_to_node[idx] = right_node
+            if self.b_strategy == "sketch":
+                self._init_sketch(left_id, left_node)
+                self._init_sketch(right_id, right_node)
 
             split_events.append(
                 NodeSplitEvent(
-                    parent_node=node, left_child=left_node, right_child=right_node
+                    parent_node=node,
+                    left_child=left_node,
+                    right_child=right_node,
+                    left_indices=left_idx,
+                    right_indices=right_idx,
                 )
             )
 
-        self._leaf_nodes = deque(leaf_nodes)
-
         return split_events
 
+    def _plan_split(self, node: Node) -> tuple[Hyperplane, np.ndarray]:
+        """
+        Choose the hyperplane splitting a leaf.
+        Args:
+            node (Node): The leaf to be split.
+        Returns:
+            tuple[Hyperplane, np.ndarray]: The hyperplane and, for every data point
+            of the leaf, whether it goes to the left child.
+        """
+        if node.depth == self.normals.shape[0]:
+            self._add_normal()
+
+        projections = self._project(node.indices, node.depth)
+        sketch = self._sketches.pop(self._flat_tree.get_node_id(node), None)
+        hyperplane = generate_hyperplane(
+            normal_vector=self._get_normal(node.depth),
+            rng=self._rng,
+            projections=projections,
+            b_strategy=self.b_strategy,
+            offset=sketch.quantile(0.5) if sketch is not None else None,
+        )
+
+        return hyperplane, projections >= hyperplane.offset
+
+    def _update_sketch(self, leaf_id: int, node: Node, projections: np.ndarray) -> None:
+        """
+        Add the projections of points inserted into a leaf to its sketch. A leaf
+        whose points predate its sketch, e.g. after eviction, gets none and is
+        split with the exact median instead.
+        """
+        sketch = self._sketches.get(leaf_id)
+        if sketch is None:
+            if node.size > 0:
+                return
+            sketch = self._sketches[leaf_id] = QuantileSketch(seed=self.seed)
+
+        if node.depth < projections.shape[1]:
+            sketch.update(projections[:, node.depth])
+        else:
+            del self._sketches[leaf_id]
+
+    def _init_sketch(self, leaf_id: int, node: Node) -> None:
+        """
+        Seed the sketch of a new child from the projection cache. Children whose
+        projections are not all cached get no sketch rather than projecting rows
+        that the split of the child would project again.
+        """
+        if self._projections is None or node.depth >= self._projections.n_columns:
+            return
+
+        projections = self._projections.get(node.indices, node.depth)
+        if np.isnan(projections).any():
+            return
+        sketch = QuantileSketch(seed=self.seed)
+        sketch.update(projections)
+        self._sketches[leaf_id] = sketch
+
+    def _add_normal(self) -> None:
+        normal = generate_normal(
+            self.data.n_features,  # type: ignore
+            self._rng,
+            dtype=self.data.compute_dtype,
+            family=self.normal_family,
+        )
+        self.normals = stack_normals(self.normals, normal)
+        if self._projections is not None:
+            self._projections.add_column()
+
+    def _project(self, indices: np.ndarray, depth: int) -> np.ndarray:
+        """
+        Projections of the given data points onto the normal vector of `depth`.
+        Cached projections are reused; only the missing ones are computed from
+        the stored data and added to the cache.
+        Args:
+            indices (np.ndarray): Ids of the data points.
+            depth (int): Depth of the normal vector.
+        Returns:
+            np.ndarray: The projections, shape (n_samples,).
+        """
+        normal = self._get_normal(depth)
+        if self._projections is None:
+            return self._project_rows(indices, normal)
+
+        projections = self._projections.get(indices, depth)
+        missing = np.isnan(projections)
+        if missing.any():
+            missing_indices = indices[missing]
+            projections[missing] = self._project_rows(missing_indices, normal)
+            self._projections.set(missing_indices, depth, projections[missing])
+
+        return projections
+
+    def _get_normal(self, depth: int) -> np.ndarray | sp.csr_array:
+        if sp.issparse(self.normals):
+            return self.normals[[depth]]  # type: ignore
+        return self.normals[depth]
+
+    def _project_rows(
+        self, indices: np.ndarray, normal: np.ndarray | sp.csr_array
+    ) -> np.ndarray:
+        """
+        Project stored rows onto a normal. For a sparse normal only the columns
+        of its nonzero coordinates are gathered from the storage.
+        """
+        if sp.issparse(normal):
+            return self.data.take(indices, normal.indices) @ normal.data  # type: ignore
+        return self.data[indices] @ normal
+
+    def evict(self, offset: int) -> None:
+        """
+        Remove every data point with an id below `offset` from the leaves.
+        A leaf that becomes empty is folded back into its parent together with
+        its sibling, when the sibling is a leaf as well.
+        Args:
+            offset (int): Id of the oldest data point to keep.
+        """
+        n_evicted = offset - self._id_offset
+        if n_evicted <= 0:
+            return
+
+        id_to_node = self._flat_tree.id_to_node
+        affected_ids = np.unique(self._leaf_ids[:n_evicted]).tolist()
+        affected = {id(node): node for node in (id_to_node[i] for i in affected_ids)}
+        for leaf_id in affected_ids:
+            self._sketches.pop(leaf_id, None)
+        self._leaf_ids = self._leaf_ids[n_evicted:]
+        self._leaf_id_head += n_evicted
+        self._id_offset = offset
+        if self._projections is not None:
+            self._projections.evict(offset)
+
+        for node in affected.values():
+            node.indices = node.indices[node.indices >= offset]
+            node._buffer = None
+
+        node_to_id = self._flat_tree.node_to_id
+        for node in affected.values():
+            if id(node) not in node_to_id:
+                continue
+
+            while node.size == 0 and node.parent is not None:
+                parent = node.parent
+                sibling = parent.right if parent.left is node else parent.left
+                if not sibling.is_leaf:
+                    break
+
+                sibling_id = self._flat_tree.get_node_id(sibling)
+                self._sketches.pop(sibling_id, None)
+                self._remove_leaf(self._flat_tree.get_node_id(node))
+                self._remove_leaf(sibling_id)
+                self._flat_tree.collapse_node(parent)
+                parent.indices = sibling.indices
+                parent._buffer = sibling._buffer
+                parent.is_leaf = True
+                parent._left = parent._right = parent._hyperplane = None
+                parent_id = self._flat_tree.get_node_id(parent)
+                self._leaf_ids[parent.indices - offset] = parent_id
+                self._add_leaf(parent_id, parent)
+                if parent.size > self.leaf_max_size:
+                    self._dirty_leaves.add(parent_id)
+
+                node = parent
+
+    def get_leaf_ids(self) -> np.ndarray:
+        """
+        Leaf id of every live data point, indexed by `id - get_id_offset()`.
+        Leaf ids are resolved to nodes with `get_leaf_table()`.
+        """
+        return self._leaf_ids
+
+    def get_leaf_table(self) -> list[Node | None]:
+        """
+        Mapping from leaf ids to Node objects.
+        """
+        return self._flat_tree.id_to_node
+
     def get_id_to_node_mapping(self) -> list[Node]:
-        return self._id_to_node
+        """
+        Leaf node of every live data point, indexed by `id - get_id_offset()`.
+        """
+        id_to_node = self._flat_tree.id_to_node
+        return [id_to_node[leaf_id] for leaf_id in self._leaf_ids.tolist()]  # type: ignore
+
+    def get_id_offset(self) -> int:
+        return self._id_offset
 
     def get_node_by_id(self, idx: int) -> Node:
-        return self._id_to_node[idx]
+        return self._flat_tree.id_to_node[self._leaf_ids[idx - self._id_offset]]  # type: ignore
 
     def get_leaf_nodes(self) -> list[Node]:
-        return list(self._leaf_nodes)
+        return list(self._leaf_nodes.values())
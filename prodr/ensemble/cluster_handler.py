@@ -1,16 +1,25 @@
-import scipy.sparse as sp
-from scipy.sparse.csgraph import connected_components
+import numpy as np
 
 from .types import (
     NodeSplitEvent,
     MicroClusterSplitEvent,
     MicroClusterMergeEvent,
     MicroClusterCreationEvent,
+    MicroClusterRemovalEvent,
+)
+from .components import (
+    CooccurrenceGraph,
+    MicroCluster,
+    Node,
+    ProgressiveDataStorage,
 )
-from .components import MicroCluster, Node, ProgressiveDataStorage
 from .utils import (
-    generate_cooccurr_acc_mtx,
+    gather_leaf_candidates,
+    select_top_k,
+    count_thresholded_pairs,
     split_micro_cluster,
+    split_micro_cluster_locally,
+    collect_split_decrements,
     count_mcs_new_data_cooccurrence,
     update_micro_clusters_with_new_data,
 )
@@ -21,6 +30,8 @@ class ClusterHandler:
     Handler for managing micro-clusters based on ensemble tree events.
     Attributes:
         micro_clusters (list[MicroCluster]): List of current micro-clusters.
+        graph (CooccurrenceGraph): Co-occurrence counts of the pairs of data points
+        holding the micro-clusters together.
         id_to_mc (list[MicroCluster]): Mapping from data point IDs to their corresponding micro
         clusters.
     """
@@ -34,12 +45,20 @@ class ClusterHandler:
         self.data = data
         self.threshold = threshold
 
-        self.micro_clusters: list[MicroCluster] = []
+        # Insertion-ordered set, so micro-clusters are removed in O(1).
+        self._micro_clusters: dict[MicroCluster, None] = {}
+        self.graph = CooccurrenceGraph(threshold=threshold)
         self.id_to_mc: dict[int, MicroCluster] = {}
         self.mcid_to_mc: dict[int, MicroCluster] = {}
 
         self._initialized = False
-        self._initialization_phase = False
+        # Points below this id were clustered by the initialization.
+        self._initialized_size = 0
+        self._id_offset = data.offset
+
+    @property
+    def micro_clusters(self) -> list[MicroCluster]:
+        return list(self._micro_clusters)
 
     def _ensure_initialized(self, all_leaf_nodes: list[list[Node]]) -> bool:
         if self._initialized:
@@ -47,24 +66,23 @@ class ClusterHandler:
         elif len(all_leaf_nodes[0]) > 8:
             self._initialization(all_leaf_nodes)
             self._initialized = True
-            self._initialization_phase = True
+            self._initialized_size = self.data.size
             return True
         else:
             return False
 
     def _initialization(self, all_leaf_nodes: list[list[Node]]) -> None:
-        n_samples = self.data.size
+        offset = self.data.offset
+        n_samples = self.data.size - offset
 
-        cooccurr_cnt_list = [
-            [node.indices for node in tree_leaf_nodes]
-            for tree_leaf_nodes in all_leaf_nodes
-        ]
-        cooccurr_cnt_mtx = generate_cooccurr_acc_mtx(cooccurr_cnt_list, n_samples)
+        self.graph.add(
+            *count_thresholded_pairs(all_leaf_nodes, n_samples, offset, self.threshold)
+        )
 
         init_mc = MicroCluster(
-            indices=list(range(n_samples)),
-            cooccurrence_count=cooccurr_cnt_mtx,
-            head=0,
+            indices=list(range(offset, offset + n_samples)),
+            head=offset,
+            graph=self.graph,
         )
 
         micro_clusters, _ = split_micro_cluster(
@@ -72,11 +90,11 @@ class ClusterHandler:
             self.threshold,
         )
 
-        self.micro_clusters = micro_clusters
+        self._micro_clusters = dict.fromkeys(micro_clusters)
         self._initialize_id_to_mc_mapping()
 
     def _initialize_id_to_mc_mapping(self) -> None:
-        for mc in self.micro_clusters:
+        for mc in self._micro_clusters:
             for i in mc.indices:
                 self.id_to_mc[i] = mc
 
@@ -86,54 +104,30 @@ class ClusterHandler:
         all_leaf_nodes: list[list[Node]],
         split_events: list[list[NodeSplitEvent]],
     ) -> list[MicroClusterSplitEvent]:
-        if not self._ensure_initialized(all_leaf_nodes):
+        if not self._initialized:
+            # Co-occurrences are counted on the leaves after these splits.
+            self._ensure_initialized(all_leaf_nodes)
             return []
         mc_split_events: list[MicroClusterSplitEvent] = []
 
-        dirty_mcs: set[MicroCluster] = set()
-
-        for tree_events in split_events:
-            for event in tree_events:
-                left_ids = [i for i in event.left_child.indices if i < start_idx]
-                right_ids = [i for i in event.right_child.indices if i < start_idx]
-
-                per_mc_left: dict[MicroCluster, list[int]] = {}
-                per_mc_right: dict[MicroCluster, list[int]] = {}
-
-                for lid in left_ids:
-                    mc = self.id_to_mc[lid]
-                    mc.get_local_idx(lid)
-                    per_mc_left.setdefault(mc, []).append(lid)
-
-                for rid in right_ids:
-                    mc = self.id_to_mc[rid]
-                    mc.get_local_idx(rid)
-                    per_mc_right.setdefault(mc, []).append(rid)
-
-                common_mcs = set(per_mc_left.keys()).intersection(per_mc_right.keys())
-
-                for mc in common_mcs:
-                    lids = per_mc_left[mc]
-                    rids = per_mc_right[mc]
-
-                    rows = [lid for lid in lids for _ in rids]
-                    cols = [rid for _ in lids for rid in rids]
-                    counts = [-1] * len(rows)
-
-                    mc.update_cooccurrence_count(
-                        rows,
-                        cols,
-                        counts,
-                    )
-
-                    if mc.is_dirty(self.threshold):
-                        dirty_mcs.add(mc)
-
-        for mc in dirty_mcs:
-            new_mcs, inherit_mc_label = split_micro_cluster(mc, self.threshold)
+        # All decrements of the round are applied at once; a micro-cluster is
+        # dirty when one of its edges fell below the threshold.
+        rows, cols = collect_split_decrements(split_events, start_idx, self.id_to_mc)
+        broken_rows, broken_cols = self.graph.decrement(rows, cols)
+        broken_by_mc: dict[MicroCluster, list[int]] = {}
+        for e, i in enumerate(broken_rows.tolist()):
+            broken_by_mc.setdefault(self.id_to_mc[i], []).append(e)
+
+        for mc, edges in broken_by_mc.items():
+            new_mcs, inherit_mc_label = split_micro_cluster_locally(
+                mc, broken_rows[edges], broken_cols[edges], self.threshold
+            )
+            if len(new_mcs) == 1:
+                # The dropped edges did not disconnect the micro-cluster.
+                continue
 
-            self.micro_clusters.remove(mc)
-            self.micro_clusters.extend(new_mcs)
+            del self._micro_clusters[mc]
+            self._micro_clusters.update(dict.fromkeys(new_mcs))
 
             mc_split_events.append(
                 MicroClusterSplitEvent(
@@ -152,52 +146,154 @@ class ClusterHandler:
     def handle_insertion(
         self,
         start_idx: int,
-        forest_id2node: list[list[Node]],
+        forest_leaf_ids: np.ndarray,
+        leaf_tables: list[list[Node | None]],
     ) -> tuple[
         list[MicroClusterMergeEvent],
         list[MicroClusterCreationEvent],
     ]:
-        if not self._initialized or self._initialization_phase:
-            self._initialization_phase = False
+        # The initialization may have run in the same update or in a flush.
+        if not self._initialized or start_idx < self._initialized_size:
             return [], []
 
         end_idx = self.data.size - 1
 
-        coocc_mtx, neighbors_of_new = count_mcs_new_data_cooccurrence(
-            micro_clusters=self.micro_clusters,
+        new_ids, neighbor_ids, counts = count_mcs_new_data_cooccurrence(
             new_data_idx_range=(start_idx, end_idx),
-            forest_id2node=forest_id2node,
+            forest_leaf_ids=forest_leaf_ids,
+            leaf_tables=leaf_tables,
             threshold=self.threshold,
-            id_to_mc=self.id_to_mc,
         )
+        self.graph.add(new_ids, neighbor_ids, counts)
 
         merge_events, creation_events, created_mcs, removed_mcs = (
             update_micro_clusters_with_new_data(
-                coocurrence_matrix=coocc_mtx,
-                micro_clusters=self.micro_clusters,
-                start_idx=start_idx,
-                neighbors_of_new_data=neighbors_of_new,
+                new_data_idx_range=(start_idx, end_idx),
+                new_ids=new_ids,
+                neighbor_ids=neighbor_ids,
+                id_to_mc=self.id_to_mc,
+                graph=self.graph,
             )
         )
 
-        if removed_mcs:
-            self.micro_clusters = [
-                mc for mc in self.micro_clusters if mc not in removed_mcs
-            ]
-
-        if created_mcs:
-            self.micro_clusters.extend(created_mcs)
-            for mc in created_mcs:
-                for i in mc.indices:
-                    self.id_to_mc[i] = mc
+        for mc in removed_mcs:
+            del self._micro_clusters[mc]
+        self._micro_clusters.update(dict.fromkeys(created_mcs))
 
         return merge_events, creation_events
 
-        # # TODO: mc_indices 중에서 제일 큰걸 찾아서 그것끼리 병합
-        # # TODO: 그렇게 나온 대장에게 data_indices를 한꺼번에 추가 (data_indices)끼리 먼저합치고 합치는게 나을수도?
+    def predict(
+        self, leaf_ids: np.ndarray, leaf_tables: list[list[Node | None]]
+    ) -> np.ndarray:
+        """
+        Assign points to existing micro-clusters without inserting them. Every
+        live data point sharing a leaf with a point in at least `threshold` trees
+        votes for its micro-cluster with its co-leaf count.
+        Args:
+            leaf_ids (np.ndarray): Leaf id of every point in every tree, shape
+                (n_samples, n_trees).
+            leaf_tables (list[list[Node | None]]): Mapping from leaf ids to nodes
+                per tree.
+        Returns:
+            np.ndarray: Head id (`MicroCluster.head`) of the micro-cluster with the
+            most votes for every point, -1 where no micro-cluster got a vote.
+        """
+        n_samples = leaf_ids.shape[0]
+        labels = np.full(n_samples, -1, dtype=np.int64)
+        if not self._initialized or n_samples == 0:
+            return labels
+
+        queries, candidates, counts = gather_leaf_candidates(leaf_ids, leaf_tables)
+        neighbors = counts >= self.threshold
+        queries, candidates, counts = (
+            queries[neighbors],
+            candidates[neighbors],
+            counts[neighbors],
+        )
+
+        unique_ids, inverse = np.unique(candidates, return_inverse=True)
+        heads = np.array(
+            [
+                mc.head if (mc := self.id_to_mc.get(i)) is not None else -1
+                for i in unique_ids.tolist()
+            ],
+            dtype=np.int64,
+        )[inverse]
+        voted = heads >= 0
+        queries, heads, counts = queries[voted], heads[voted], counts[voted]
+
+        order = np.lexsort((heads, queries))
+        queries, heads, counts = queries[order], heads[order], counts[order]
+        is_first = np.ones(queries.shape[0], dtype=bool)
+        is_first[1:] = (queries[1:] != queries[:-1]) | (heads[1:] != heads[:-1])
+        starts = np.flatnonzero(is_first)
+        votes = np.add.reduceat(counts, starts) if starts.size else counts
+
+        rows, _, best = select_top_k(
+            queries[starts], heads[starts], -votes, n_samples, 1
+        )
+        labels[rows] = heads[starts][best]
+
+        return labels
+
+    def evict(
+        self, offset: int
+    ) -> tuple[list[MicroClusterSplitEvent], list[MicroClusterRemovalEvent]]:
+        """
+        Remove every data point with an id below `offset` from the micro-clusters.
+        Their co-occurrences are dropped with them; micro-clusters that lose all
+        of their points are removed and the others are split into their remaining
+        connected components.
+        Args:
+            offset (int): Id of the oldest data point to keep.
+        """
+        mc_split_events: list[MicroClusterSplitEvent] = []
+        mc_removal_events: list[MicroClusterRemovalEvent] = []
+
+        affected_mcs: set[MicroCluster] = set()
+        for i in range(self._id_offset, offset):
+            mc = self.id_to_mc.pop(i, None)
+            if mc is not None:
+                affected_mcs.add(mc)
+        self._id_offset = max(self._id_offset, offset)
+        self.graph.evict(offset)
+
+        if not affected_mcs:
+            return mc_split_events, mc_removal_events
+
+        new_micro_clusters: list[MicroCluster] = []
+        for mc in affected_mcs:
+            kept = [i for i in mc.indices if i >= offset]
+            if not kept:
+                mc_removal_events.append(
+                    MicroClusterRemovalEvent(removed_micro_cluster=mc)
+                )
+                continue
+
+            remaining_mc = MicroCluster(
+                indices=kept,
+                head=mc.head if mc.head >= offset else kept[0],
+                graph=self.graph,
+            )
+            new_mcs, inherit_mc_label = split_micro_cluster(
+                remaining_mc, self.threshold
+            )
+            new_micro_clusters.extend(new_mcs)
+
+            mc_split_events.append(
+                MicroClusterSplitEvent(
+                    parent_micro_cluster=mc,
+                    child_micro_clusters=new_mcs,
+                    inherit_micro_cluster=new_mcs[inherit_mc_label],
+                )
+            )
+
+            for new_mc in new_mcs:
+                for i in new_mc.indices:
+                    self.id_to_mc[i] = new_mc
 
-        # # TODO: UMAP용 로그 남기기
+        for mc in affected_mcs:
+            del self._micro_clusters[mc]
+        self._micro_clusters.update(dict.fromkeys(new_micro_clusters))
 
-        # # TODO: data_indices 중에 누구랑도 연결안되어서 혼자남은애들을 각각 MC로 추가
-        # # TODO: UMAP용 로그 남기기
-        # # TODO: id_to_mc 갱신
+        return mc_split_events, mc_removal_events
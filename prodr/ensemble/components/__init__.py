@@ -2,5 +2,12 @@ from .vector import Vector
 from .node import Node
 from .hyperplane import Hyperplane
 from .flat_tree import FlatTree
+from .cooccurrence_graph import CooccurrenceGraph
 from .micro_cluster import MicroCluster
+from .column_block import ColumnBlock
 from .data import ProgressiveDataStorage
+from .memmap_data import MemmapDataStorage
+from .sparse_data import SparseDataStorage
+from .projection_cache import ProjectionCache
+from .quantile_sketch import QuantileSketch
+from .normal_stack import NormalStack
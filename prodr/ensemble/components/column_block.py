@@ -0,0 +1,112 @@
+import sys
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+
+
+@dataclass
+class ColumnBlock:
+    """
+    A 2D block of rows described as a set of zero-copy array views.
+
+    Each part is a 2D array placed at (row_offset, col_offset) of the block, so a
+    numpy array is a single part, a DataFrame or Arrow record batch is one part
+    per column and an Arrow table adds one row range per record batch.
+    Attributes:
+        shape (tuple[int, int]): Number of rows and columns of the block.
+        parts (list[tuple[int, int, np.ndarray]]): Parts as (row_offset, col_offset, array).
+        copied_bytes (int): Bytes copied while converting the source to numpy.
+    """
+
+    shape: tuple[int, int]
+    parts: list[tuple[int, int, np.ndarray]] = field(default_factory=list)
+    copied_bytes: int = 0
+
+    @property
+    def dtype(self) -> np.dtype:
+        if not self.parts:
+            return np.dtype(np.float64)
+        return np.result_type(*[part.dtype for _, _, part in self.parts])
+
+    @classmethod
+    def from_source(cls, source: Any) -> "ColumnBlock":
+        """
+        Wrap a numpy array, pandas DataFrame, Arrow RecordBatch / Table or any
+        buffer-protocol object without copying it where possible.
+        Args:
+            source (Any): A 2D block of rows.
+        Returns:
+            ColumnBlock: The wrapped block.
+        """
+        if isinstance(source, ColumnBlock):
+            return source
+        elif isinstance(source, np.ndarray):
+            return cls._from_array(source)
+        elif _is_instance_of(source, "pandas", "DataFrame"):
+            return cls._from_dataframe(source)
+        elif _is_instance_of(source, "pyarrow", "RecordBatch"):
+            return cls._from_record_batches([source], source.num_columns)
+        elif _is_instance_of(source, "pyarrow", "Table"):
+            return cls._from_record_batches(source.to_batches(), source.num_columns)
+
+        try:
+            array = np.asarray(memoryview(source))
+            copied_bytes = 0
+        except TypeError:
+            array = np.asarray(source)
+            copied_bytes = array.nbytes
+
+        block = cls._from_array(array)
+        block.copied_bytes = copied_bytes
+        return block
+
+    @classmethod
+    def _from_array(cls, array: np.ndarray) -> "ColumnBlock":
+        if array.ndim != 2:
+            raise ValueError(f"Expected a 2D block, got {array.ndim} dimensions.")
+        return cls(shape=array.shape, parts=[(0, 0, array)])  # type: ignore
+
+    @classmethod
+    def _from_dataframe(cls, df: Any) -> "ColumnBlock":
+        parts: list[tuple[int, int, np.ndarray]] = []
+        copied_bytes = 0
+
+        for j in range(df.shape[1]):
+            column = df.iloc[:, j]
+            array = column.to_numpy()
+            if not isinstance(column.dtype, np.dtype):
+                copied_bytes += array.nbytes
+            parts.append((0, j, array.reshape(-1, 1)))
+
+        return cls(shape=df.shape, parts=parts, copied_bytes=copied_bytes)
+
+    @classmethod
+    def _from_record_batches(cls, batches: list[Any], n_columns: int) -> "ColumnBlock":
+        parts: list[tuple[int, int, np.ndarray]] = []
+        copied_bytes = 0
+        row_offset = 0
+
+        for batch in batches:
+            for j in range(n_columns):
+                column = batch.column(j)
+                try:
+                    array = column.to_numpy(zero_copy_only=True)
+                except Exception:  # pylint: disable=broad-except
+                    array = column.to_numpy(zero_copy_only=False)
+                    copied_bytes += array.nbytes
+                parts.append((row_offset, j, array.reshape(-1, 1)))
+            row_offset += batch.num_rows
+
+        return cls(
+            shape=(row_offset, n_columns), parts=parts, copied_bytes=copied_bytes
+        )
+
+
+def _is_instance_of(obj: Any, module: str, name: str) -> bool:
+    """
+    isinstance check against an optional dependency that is only consulted when
+    it has already been imported by the caller.
+    """
+    mod = sys.modules.get(module)
+    return mod is not None and isinstance(obj, getattr(mod, name))
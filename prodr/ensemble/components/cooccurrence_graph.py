@@ -0,0 +1,321 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import scipy.sparse as sp
+
+_LOW_BITS = np.int64(0xFFFFFFFF)
+# Ids are stored relative to `CooccurrenceGraph._base` and must fit in 31 bits
+# so that packed keys stay positive.
+_MAX_ID = (1 << 31) - 1
+
+
+def _pack(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    return (np.minimum(rows, cols) << 32) | np.maximum(rows, cols)
+
+
+def _unpack(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return keys >> 32, keys & _LOW_BITS
+
+
+def _mirror(keys: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Both orientations of canonical keys, sorted, with their values.
+    """
+    rows, cols = _unpack(keys)
+    keys = np.concatenate([keys, (cols << 32) | rows])
+    values = np.concatenate([values, values])
+    order = np.argsort(keys, kind="stable")
+    return keys[order], values[order]
+
+
+def _find(run_keys: np.ndarray, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Positions of `keys` in a sorted run, and whether each of them was found.
+    """
+    if run_keys.shape[0] == 0:
+        return np.zeros(keys.shape[0], dtype=np.int64), np.zeros(keys.shape[0], bool)
+    positions = np.minimum(np.searchsorted(run_keys, keys), run_keys.shape[0] - 1)
+    return positions, run_keys[positions] == keys
+
+
+@dataclass
+class CooccurrenceGraph:
+    """
+    Forest-wide store of the co-occurrence counts that hold the micro-clusters
+    together: for every pair of data points sharing a leaf in at least
+    `threshold` trees, the number of trees in which they do.
+
+    Once both points of a pair are inserted its count only goes down (leaves
+    are split, never merged), so an edge is dropped for good as soon as its
+    count falls below `threshold`. Micro-clusters are the connected components
+    of this graph and read their edges through `subgraph`.
+
+    Edges are packed into int64 keys (id << 32 | other id) kept in a few sorted
+    runs, once per orientation, so the neighbors of a point are a contiguous
+    range of keys. The count lives on the (lower id, higher id) key; the
+    mirrored key only marks the edge as live. Ids are stored relative to a base
+    that `evict` moves forward, so live ids must span less than 2**31; ids out
+    of range raise a ValueError. New edges form a new run, which is merged with
+    the smaller runs before it, so there are O(log n_edges) runs and every edge is copied
+    O(log n_edges) times. Increments and decrements are vectorized binary
+    searches into the runs; dropped edges are zeroed in place and purged when
+    runs are merged, or by a full compaction once they make up
+    `compaction_ratio` of the store.
+    Attributes:
+        threshold (int): Minimum count of an edge.
+        compaction_ratio (float): Share of dropped edges triggering a compaction.
+    """
+
+    threshold: int
+    compaction_ratio: float = 0.25
+
+    _runs: list[tuple[np.ndarray, np.ndarray]] = field(
+        default_factory=list, init=False, repr=False
+    )
+    _n_stored: int = field(default=0, init=False, repr=False)
+    _n_dropped: int = field(default=0, init=False, repr=False)
+    _base: int = field(default=0, init=False, repr=False)
+
+    @property
+    def n_edges(self) -> int:
+        return (self._n_stored - self._n_dropped) // 2
+
+    def add(self, rows: np.ndarray, cols: np.ndarray, counts: np.ndarray) -> None:
+        """
+        Add co-occurrence counts to pairs of data points, creating their edges
+        when needed. Counts of pairs repeated in the input are summed.
+        Args:
+            rows (np.ndarray): Id of the first point of every pair.
+            cols (np.ndarray): Id of the second point of every pair.
+            counts (np.ndarray): Count added to every pair.
+        """
+        keys = _pack(self._local(rows), self._local(cols))
+        if keys.shape[0] == 0:
+            return
+        keys, counts = self._sum_duplicates(keys, np.asarray(counts, dtype=np.int32))
+
+        is_new = np.ones(keys.shape[0], dtype=bool)
+        for run_keys, run_counts in self._runs:
+            positions, found = _find(run_keys, keys)
+            found &= run_counts[positions] > 0
+            run_counts[positions[found]] += counts[found]
+            is_new &= ~found
+
+        self._push_run(*_mirror(keys[is_new], counts[is_new]))
+
+    def decrement(
+        self, rows: np.ndarray, cols: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Decrement the counts of pairs of data points by one per occurrence in
+        the input. Pairs without an edge are ignored.
+        Args:
+            rows (np.ndarray): Id of the first point of every pair.
+            cols (np.ndarray): Id of the second point of every pair.
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Endpoints of the edges that fell below
+            `threshold` and were dropped.
+        """
+        keys = _pack(self._local(rows), self._local(cols))
+        if keys.shape[0] == 0 or self.n_edges == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        keys, amounts = np.unique(keys, return_counts=True)
+
+        dropped = []
+        for run_keys, run_counts in self._runs:
+            positions, found = _find(run_keys, keys)
+            found &= run_counts[positions] > 0
+            positions = positions[found]
+            run_counts[positions] -= amounts[found]
+
+            broken = positions[run_counts[positions] < self.threshold]
+            run_counts[broken] = 0
+            dropped.append(run_keys[broken])
+            self._n_dropped += broken.shape[0]
+
+        rows, cols = _unpack(np.concatenate(dropped))
+        self._drop((cols << 32) | rows)
+
+        if self._n_dropped > self.compaction_ratio * self._n_stored:
+            self._compact()
+
+        return rows + self._base, cols + self._base
+
+    def evict(self, offset: int) -> None:
+        """
+        Drop every edge of the data points with an id below `offset`.
+        """
+        if offset <= self._base:
+            return
+        cut_key = np.int64(offset - self._base) << 32
+        runs = []
+        # Edges to kept points are also stored the other way around, past the cut.
+        mirrored = []
+        for run_keys, run_counts in self._runs:
+            cut = int(np.searchsorted(run_keys, cut_key))
+            if cut > 0:
+                rows, cols = _unpack(run_keys[:cut])
+                live = (cols >= offset - self._base) & (run_counts[:cut] > 0)
+                mirrored.append((cols[live] << 32) | rows[live])
+                n_dropped = int(np.count_nonzero(run_counts[:cut] == 0))
+                self._n_stored -= cut
+                self._n_dropped -= n_dropped
+                # Copy once most of the run is gone so the buffer can be freed.
+                copy = 2 * cut > run_keys.shape[0]
+                run_keys = run_keys[cut:].copy() if copy else run_keys[cut:]
+                run_counts = run_counts[cut:].copy() if copy else run_counts[cut:]
+            if run_keys.shape[0] > 0:
+                runs.append((run_keys, run_counts))
+        self._runs = runs
+
+        if mirrored:
+            self._drop(np.concatenate(mirrored))
+        if offset - self._base > _MAX_ID // 2:
+            self._rebase(offset)
+
+    def neighbors(self, nodes: np.ndarray | list[int]) -> np.ndarray:
+        """
+        Distinct neighbors of a set of data points.
+        Args:
+            nodes (np.ndarray | list[int]): Ids of the data points.
+        Returns:
+            np.ndarray: Sorted ids of the points sharing an edge with any of them.
+        """
+        nodes = self._local(nodes)
+        found = [np.empty(0, dtype=np.int64)]
+        for run_keys, run_counts in self._runs:
+            positions = self._ranges(run_keys, nodes)
+            live = run_counts[positions] > 0
+            found.append(_unpack(run_keys[positions[live]])[1])
+
+        return np.unique(np.concatenate(found)) + self._base
+
+    def subgraph(self, members: np.ndarray | list[int]) -> sp.csr_array:
+        """
+        Edges between a set of data points.
+        Args:
+            members (np.ndarray | list[int]): Ids of the data points.
+        Returns:
+            sp.csr_array: Symmetric matrix of the counts of the edges, indexed by
+            the positions of the points in `members`.
+        """
+        members = self._local(members)
+        n_members = members.shape[0]
+        order = np.argsort(members, kind="stable")
+        sorted_members = members[order]
+
+        rows, cols, data = [], [], []
+        for run_keys, run_counts in self._runs:
+            positions = self._ranges(run_keys, sorted_members)
+            lows, highs = _unpack(run_keys[positions])
+            local_lows, _ = _find(sorted_members, lows)
+            local_highs, inside = _find(sorted_members, highs)
+            keep = inside & (lows < highs) & (run_counts[positions] > 0)
+
+            rows.append(order[local_lows[keep]])
+            cols.append(order[local_highs[keep]])
+            data.append(run_counts[positions[keep]])
+
+        rows_arr = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        cols_arr = np.concatenate(cols) if cols else np.empty(0, dtype=np.int64)
+        data_arr = np.concatenate(data) if data else np.empty(0, dtype=np.int32)
+        upper = sp.csr_array(
+            (data_arr, (rows_arr, cols_arr)), shape=(n_members, n_members)
+        )
+        return upper + upper.T
+
+    def _local(self, ids: np.ndarray | list[int]) -> np.ndarray:
+        """
+        Ids relative to `_base`.
+        """
+        ids = np.asarray(ids, dtype=np.int64) - self._base
+        if ids.shape[0] > 0 and (ids.min() < 0 or ids.max() > _MAX_ID):
+            raise ValueError(
+                f"Data point ids must lie in [{self._base}, {self._base + _MAX_ID}]."
+            )
+        return ids
+
+    def _rebase(self, offset: int) -> None:
+        """
+        Move `_base` to `offset`, once every edge of the points below it is gone.
+        Mirrored keys of those edges are purged, the others are shifted.
+        """
+        delta = np.int64(offset - self._base)
+        runs = []
+        for run_keys, run_counts in self._runs:
+            kept = _unpack(run_keys)[1] >= delta
+            n_purged = run_keys.shape[0] - int(np.count_nonzero(kept))
+            self._n_stored -= n_purged
+            self._n_dropped -= n_purged
+            if n_purged < run_keys.shape[0]:
+                runs.append(
+                    (run_keys[kept] - ((delta << 32) + delta), run_counts[kept])
+                )
+        self._runs = runs
+        self._base = offset
+
+    def _drop(self, keys: np.ndarray) -> None:
+        """
+        Zero the live entries of some keys.
+        """
+        for run_keys, run_counts in self._runs:
+            positions, found = _find(run_keys, keys)
+            found &= run_counts[positions] > 0
+            run_counts[positions[found]] = 0
+            self._n_dropped += int(np.count_nonzero(found))
+
+    @staticmethod
+    def _ranges(run_keys: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+        """
+        Positions of the keys of the edges of `nodes` in a sorted run.
+        """
+        starts = np.searchsorted(run_keys, nodes << 32)
+        ends = np.searchsorted(run_keys, (nodes << 32) | _LOW_BITS, side="right")
+        lengths = ends - starts
+        offsets = np.cumsum(lengths) - lengths
+
+        return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+    @staticmethod
+    def _sum_duplicates(
+        keys: np.ndarray, counts: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        order = np.argsort(keys, kind="stable")
+        keys, counts = keys[order], counts[order]
+        is_first = np.ones(keys.shape[0], dtype=bool)
+        is_first[1:] = keys[1:] != keys[:-1]
+        starts = np.flatnonzero(is_first)
+
+        return keys[starts], np.add.reduceat(counts, starts).astype(np.int32)
+
+    def _push_run(self, keys: np.ndarray, counts: np.ndarray) -> None:
+        if keys.shape[0] == 0:
+            return
+        self._n_stored += keys.shape[0]
+        while self._runs and self._runs[-1][0].shape[0] <= 2 * keys.shape[0]:
+            run_keys, run_counts = self._runs.pop()
+            keys, counts = self._merge([(run_keys, run_counts), (keys, counts)])
+        self._runs.append((keys, counts))
+
+    def _merge(
+        self, runs: list[tuple[np.ndarray, np.ndarray]]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Merge runs into one, purging their dropped edges.
+        """
+        keys = np.concatenate([run_keys for run_keys, _ in runs])
+        counts = np.concatenate([run_counts for _, run_counts in runs])
+        live = counts > 0
+        n_purged = keys.shape[0] - int(np.count_nonzero(live))
+        self._n_stored -= n_purged
+        self._n_dropped -= n_purged
+
+        order = np.argsort(keys[live], kind="stable")
+        return keys[live][order], counts[live][order]
+
+    def _compact(self) -> None:
+        keys, counts = self._merge(self._runs)
+        self._runs = [(keys, counts)] if keys.shape[0] > 0 else []
@@ -1,69 +1,414 @@
+import os
+import tempfile
+import weakref
 from dataclasses import dataclass, field
-from typing import Sequence
+from typing import Any, Literal, Sequence
 
 import numpy as np
+import scipy.sparse as sp
 
 from prodr.ensemble.validators import check_feature_dim, check_dtype
 
+from .column_block import ColumnBlock
+
 
 @dataclass
 class ProgressiveDataStorage:
     """
     A data storage class that allows
     appending new data in chunks and retrieving the full dataset.
+
+    Rows are kept in a preallocated buffer whose capacity grows geometrically,
+    so appending N rows copies O(N) bytes in total instead of O(N^2 / batch_size).
+
+    With a `precision` policy, batches are converted at ingestion and rows are
+    read back as float32. "int8" stores symmetric scalar-quantized values with a
+    per-feature scale fitted on the first batch; values outside of that range
+    are clipped.
+
+    Row ids are global and never reused. `evict` expires every row below a given
+    id; the buffer slots of expired rows are recycled the next time it fills up.
+
+    `share` moves the buffers into memory-mapped files of `buffer_dir` (a tmpfs
+    such as /dev/shm by default), so that worker processes map the rows through
+    `shared_buffers` instead of holding a copy. Replaced buffer files are deleted
+    right away, the last ones when the storage is garbage collected.
     Attributes:
         n_features (int | None): Number of features in the dataset.
-        dtype (np.dtype | None): Data type of the dataset.
+        dtype (np.dtype | None): Data type of the stored rows.
+        initial_capacity (int): Number of rows reserved on the first append.
+        growth_factor (float): Factor by which the capacity grows when full.
+        precision (str | None): Storage precision ("float32", "float16" or "int8").
+            None keeps the dtype of the first batch.
+        buffer_dir (str | None): Directory of the memory-mapped buffer files of a
+            shared storage. None keeps the buffers in private memory.
     """
 
     n_features: int | None = None
     dtype: np.dtype | None = None
+    initial_capacity: int = 1024
+    growth_factor: float = 2.0
+    precision: Literal["float32", "float16", "int8"] | None = None
+    buffer_dir: str | None = None
     _X: np.ndarray | None = None
-    # _X_dirty: bool = False
     _n_samples: int = 0
+    _scale: np.ndarray | None = None
+    _offset: int = 0
+    _base: int = 0
 
-    # _chunks: list[np.ndarray] = field(default_factory=list, init=False, repr=False)
     _starts: list[int] = field(default_factory=list, init=False, repr=False)
+    _buffer_files: dict[str, str] = field(default_factory=dict, init=False, repr=False)
+
+    # Attributes holding the row buffers, in the order they are shared.
+    _BUFFERS = ("_X",)
+
+    def __post_init__(self) -> None:
+        if self.growth_factor <= 1.0:
+            raise ValueError("growth_factor must be greater than 1.")
+        if self.precision not in (None, "float32", "float16", "int8"):
+            raise ValueError(f"Unknown precision: {self.precision}")
 
     def __len__(self) -> int:
         return self.size
 
     @property
     def size(self) -> int:
+        return self._n_samples
+
+    @property
+    def offset(self) -> int:
+        """
+        Id of the oldest row that has not been evicted.
+        """
+        return self._offset
+
+    @property
+    def n_live(self) -> int:
+        return self._n_samples - self._offset
+
+    @property
+    def batch_starts(self) -> list[int]:
+        """
+        Ids of the first row of every batch that has not been evicted.
+        """
+        return self._starts
+
+    @property
+    def capacity(self) -> int:
         return self._X.shape[0] if self._X is not None else 0
 
+    @property
+    def scale(self) -> np.ndarray | None:
+        """
+        Per-feature quantization scale of the "int8" precision, None otherwise.
+        """
+        return self._scale
+
+    @property
+    def compute_dtype(self) -> np.dtype:
+        """
+        Floating point dtype used for normals, projections and offsets.
+        """
+        return np.dtype(np.float32 if self.precision is not None else np.float64)
+
+    def share(self, buffer_dir: str | None = None) -> None:
+        """
+        Move the buffers into memory-mapped files that other processes can map.
+        Rows already stored are copied once.
+        Args:
+            buffer_dir (str | None): Directory of the buffer files. Defaults to
+                /dev/shm when it exists, the temporary directory otherwise.
+        """
+        if self.buffer_dir is not None:
+            return
+        self.buffer_dir = buffer_dir or _default_buffer_dir()
+        self._reallocate()
+
+    def shared_buffers(self) -> dict[str, tuple[str, str, tuple[int, ...]]]:
+        """
+        Backing file, dtype and shape of every buffer of a shared storage, to be
+        mapped read-only by other processes.
+        """
+        buffers = {}
+        for name in self._BUFFERS:
+            buffer = getattr(self, name)
+            if buffer is not None:
+                path = os.path.abspath(self._buffer_path(name))
+                buffers[name] = (path, buffer.dtype.str, buffer.shape)
+
+        return buffers
+
     def append(self, batch: np.ndarray) -> int:
+        start, _ = self.append_block(batch)
+
+        return start
+
+    def append_block(self, source: Any) -> tuple[int, int]:
+        """
+        Append a 2D block of rows from a numpy array, pandas DataFrame, Arrow
+        RecordBatch / Table or buffer-protocol object. Columns are written straight
+        into the storage buffer, converting to the stored dtype on the fly.
+        Args:
+            source (Any): The block of rows to append.
+        Returns:
+            tuple[int, int]: Index of the first appended row and the number of bytes
+            copied (conversions, buffer growth and the write into the buffer).
+        """
+        if sp.issparse(source):
+            raise ValueError(
+                "Sparse batches require a SparseDataStorage (storage='sparse')."
+            )
+        block = ColumnBlock.from_source(source)
+
         if self.n_features is None:
-            self.n_features = batch.shape[1]
-            self.dtype = batch.dtype
+            self.n_features = block.shape[1]
+            self.dtype = self._storage_dtype(block.dtype)
         else:
-            check_feature_dim(batch, self.n_features)
-            check_dtype(batch.dtype, self.dtype)
+            check_feature_dim(block, self.n_features)  # type: ignore
+            check_dtype(self._storage_dtype(block.dtype), self.dtype)
 
         start = self._n_samples
-        # self._chunks.append(batch)
-        self._starts.append(self._n_samples)
-        # self._X_dirty = True
-        self._n_samples += batch.shape[0]
-        self._X = np.vstack([self._X, batch]) if self._X is not None else batch
+        end = start + block.shape[0]
+        copied_bytes = block.copied_bytes + self._reserve(end)
+        rows = slice(start - self._base, end - self._base)
+        copied_bytes += self._write_block(block, self._X[rows])  # type: ignore
 
-        return start
+        self._starts.append(start)
+        self._n_samples = end
+
+        return start, copied_bytes
+
+    def _storage_dtype(self, dtype: np.dtype) -> np.dtype:
+        if self.precision is None:
+            return np.dtype(dtype)
+        return np.dtype(self.precision)
+
+    def _write_block(self, block: ColumnBlock, out: np.ndarray) -> int:
+        """
+        Write a block into `out`, encoding it to the storage precision.
+        Args:
+            block (ColumnBlock): Incoming block.
+            out (np.ndarray): Destination rows of the storage buffer.
+        Returns:
+            int: Number of bytes copied.
+        """
+        if block.shape[0] == 0:
+            return 0
+
+        copied_bytes = 0
+        if self.precision == "int8" and self._scale is None:
+            self._scale = self._fit_scale(block)
 
-    # def get_data(self) -> np.ndarray:
-    #     if self._X is None and not self._chunks:
-    #         raise ValueError("No data available.")
+        for row_offset, col_offset, part in block.parts:
+            n_rows, n_cols = part.shape
+            rows = slice(row_offset, row_offset + n_rows)
+            cols = slice(col_offset, col_offset + n_cols)
+            if self.precision == "int8":
+                part = np.clip(np.rint(part / self._scale[cols]), -127, 127)  # type: ignore
+                copied_bytes += part.nbytes
+            out[rows, cols] = part
+            copied_bytes += n_rows * n_cols * out.itemsize
 
-    #     if self._X is None:
-    #         self._X = np.vstack(self._chunks)
-    #     elif self._X_dirty:
-    #         self._X = np.vstack([self._X] + self._chunks)
-    #         self._chunks = []
-    #         self._X_dirty = False
+        return copied_bytes
 
-    #     return self._X
+    def _fit_scale(self, block: ColumnBlock) -> np.ndarray:
+        """
+        Fit a symmetric per-feature int8 quantization scale on a block.
+        """
+        max_abs = np.zeros(block.shape[1], dtype=np.float32)
+        for _, col_offset, part in block.parts:
+            if part.shape[0] == 0:
+                continue
+            cols = slice(col_offset, col_offset + part.shape[1])
+            max_abs[cols] = np.maximum(max_abs[cols], np.abs(part).max(axis=0))
+
+        scale = max_abs / 127
+        return np.where(scale > 0, scale, 1).astype(np.float32)
+
+    def _decode(self, X: np.ndarray, columns: Any = slice(None)) -> np.ndarray:
+        if self.precision is None:
+            return X
+        elif self.precision != "int8" or self._scale is None:
+            # Without a scale no row was stored yet, so `X` is empty.
+            return X.astype(np.float32, copy=False)
+        return X.astype(np.float32) * self._scale[columns]  # type: ignore
+
+    def evict(self, offset: int) -> None:
+        """
+        Expire every row with an id below `offset`.
+        Args:
+            offset (int): Id of the oldest row to keep.
+        """
+        if offset <= self._offset:
+            return
+        if offset > self._n_samples:
+            raise ValueError(f"Cannot evict beyond the last row ({self._n_samples}).")
+
+        self._offset = offset
+        self._starts = [start for start in self._starts if start >= offset]
+
+    def _reserve(self, n_rows: int) -> int:
+        """
+        Make sure the buffer can hold the rows with ids below `n_rows`.
+        Expired rows are dropped from the front of the buffer first when that frees
+        enough room; otherwise the buffer grows geometrically.
+        Args:
+            n_rows (int): Required number of rows.
+        Returns:
+            int: Number of bytes copied to compact or grow the buffer.
+        """
+        capacity = self.capacity
+        if self._X is not None and n_rows - self._base <= capacity:
+            return 0
+
+        n_live = n_rows - self._offset
+        if self._offset > self._base and n_live * self.growth_factor <= capacity:
+            copied_bytes = self._compact()
+        else:
+            new_capacity = max(capacity, self.initial_capacity, 1)
+            while new_capacity < n_live:
+                new_capacity = max(
+                    int(new_capacity * self.growth_factor), new_capacity + 1
+                )
+            self._X, copied_bytes = self._allocate(new_capacity)
+
+        self._base = self._offset
+
+        return copied_bytes
+
+    def _compact(self) -> int:
+        """
+        Move the live rows to the front of the buffer.
+        Returns:
+            int: Number of bytes copied.
+        """
+        live = self._X[self._offset - self._base : self._n_samples - self._base]  # type: ignore
+        self._X[: live.shape[0]] = live  # type: ignore
+
+        return live.nbytes
+
+    def _allocate(self, capacity: int) -> tuple[np.ndarray, int]:
+        """
+        Allocate a buffer of `capacity` rows holding the live rows at its front.
+        Args:
+            capacity (int): Number of rows of the new buffer.
+        Returns:
+            tuple[np.ndarray, int]: The new backing buffer and the number of bytes
+            copied into it.
+        """
+        X = self._new_buffer("_X", (capacity, self.n_features), self.dtype)  # type: ignore
+        if self._X is None:
+            return X, 0
+
+        live = self._X[self._offset - self._base : self._n_samples - self._base]
+        X[: live.shape[0]] = live
+        return X, live.nbytes
+
+    def _reallocate(self) -> None:
+        """
+        Allocate the buffers anew, with the live rows at their front.
+        """
+        if self._X is not None:
+            self._X, _ = self._allocate(self.capacity)
+            self._base = self._offset
+
+    def _new_buffer(
+        self, name: str, shape: tuple[int, ...], dtype: Any, zero: bool = False
+    ) -> np.ndarray:
+        """
+        Allocate the buffer stored in attribute `name`, in a new file of
+        `buffer_dir` for a shared storage. The file it replaces is deleted; the
+        mappings still open on it stay valid.
+        """
+        if self.buffer_dir is None:
+            return (
+                np.zeros(shape, dtype=dtype) if zero else np.empty(shape, dtype=dtype)
+            )
+
+        fd, path = tempfile.mkstemp(prefix="prodr-", dir=self.buffer_dir)
+        os.close(fd)
+        # New files are zero-filled.
+        buffer = np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+
+        if not self._buffer_files:
+            weakref.finalize(self, _remove_files, self._buffer_files)
+        previous = self._buffer_files.get(name)
+        self._buffer_files[name] = path
+        if previous is not None:
+            os.unlink(previous)
+
+        return buffer
+
+    def _buffer_path(self, name: str) -> str:
+        if name not in self._buffer_files:
+            raise ValueError("The storage is not shared; call share() first.")
+        return self._buffer_files[name]
+
+    def _to_local(
+        self, idx: int | slice | np.ndarray | Sequence[int]
+    ) -> int | slice | np.ndarray | Sequence[int]:
+        """
+        Translate global row ids into positions among the live rows.
+        """
+        offset = self._offset
+        if offset == 0:
+            return idx
+
+        if isinstance(idx, slice):
+            start, stop = idx.start, idx.stop
+            if start is not None and 0 <= start < offset:
+                raise IndexError(f"Row {start} has been evicted.")
+            return slice(
+                start - offset if start is not None and start >= 0 else start,
+                stop - offset if stop is not None and stop >= 0 else stop,
+                idx.step,
+            )
+        elif isinstance(idx, (int, np.integer)):
+            if 0 <= idx < offset:
+                raise IndexError(f"Row {idx} has been evicted.")
+            return idx - offset if idx >= 0 else idx
+
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            return idx
+        if idx.size and idx.min() < offset:
+            raise IndexError("Some of the requested rows have been evicted.")
+        return idx - offset
+
+    def take(
+        self, rows: np.ndarray | Sequence[int], columns: np.ndarray | Sequence[int]
+    ) -> np.ndarray:
+        """
+        Gather a block of rows restricted to some columns, reading and decoding
+        only those columns.
+        Args:
+            rows (np.ndarray | Sequence[int]): Global row ids.
+            columns (np.ndarray | Sequence[int]): Column indices.
+        Returns:
+            np.ndarray: The block, shape (len(rows), len(columns)).
+        """
+        if self._X is None:
+            raise ValueError("No data available.")
+        X = self._X[self._offset - self._base : self._n_samples - self._base]
+        columns = np.asarray(columns)
+        local_rows = np.asarray(self._to_local(rows))
+
+        return self._decode(X[np.ix_(local_rows, columns)], columns)
 
     def __getitem__(self, idx: int | slice | np.ndarray | Sequence[int]) -> np.ndarray:
         if self._X is None:
             raise ValueError("No data available.")
-        X = self._X
-        return X[idx]
+        X = self._X[self._offset - self._base : self._n_samples - self._base]
+        return self._decode(X[self._to_local(idx)])
+
+
+def _default_buffer_dir() -> str:
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def _remove_files(files: dict[str, str]) -> None:
+    for path in files.values():
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
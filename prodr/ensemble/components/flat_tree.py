@@ -10,6 +10,10 @@ class FlatTree:
     """
     A flattened representation of an adaptive partitioning tree.
 
+    The topology is kept in preallocated numpy arrays that grow geometrically, so
+    the compiled traversal kernel can read them directly without rebuilding them.
+    Slots of nodes removed by `collapse_node` are reused by later insertions.
+
     Attributes:
         root (Node): The root node of the tree.
         root_id (int): The identifier for the root node.
@@ -22,18 +26,49 @@ class FlatTree:
 
     root: Node
     root_id: int = 0
+    initial_capacity: int = 64
 
-    left: list[int] = field(default_factory=lambda: [-1])
-    right: list[int] = field(default_factory=lambda: [-1])
-    thresholds: list[float | np.float64] = field(default_factory=lambda: [np.nan])
-    depth: list[int] = field(default_factory=lambda: [0])
+    _left: np.ndarray = field(init=False, repr=False)
+    _right: np.ndarray = field(init=False, repr=False)
+    _thresholds: np.ndarray = field(init=False, repr=False)
+    _depth: np.ndarray = field(init=False, repr=False)
+    n_nodes: int = field(default=0, init=False)
 
-    id_to_node: list[Node] = field(default_factory=lambda: [])
+    id_to_node: list[Node | None] = field(default_factory=lambda: [])
     node_to_id: dict[int, int] = field(default_factory=lambda: {})
+    _free_ids: list[int] = field(default_factory=list, init=False, repr=False)
 
     def __post_init__(self):
-        self.id_to_node.append(self.root)
+        capacity = max(self.initial_capacity, self.root_id + 1)
+        self._left = np.full(capacity, -1, dtype=np.int64)
+        self._right = np.full(capacity, -1, dtype=np.int64)
+        self._thresholds = np.full(capacity, np.nan, dtype=np.float64)
+        self._depth = np.zeros(capacity, dtype=np.int64)
+
+        self.id_to_node.extend([None] * (self.root_id + 1 - len(self.id_to_node)))
+        self.id_to_node[self.root_id] = self.root
         self.node_to_id[id(self.root)] = self.root_id
+        self._depth[self.root_id] = self.root.depth
+        self.n_nodes = self.root_id + 1
+
+    @property
+    def left(self) -> np.ndarray:
+        return self._left[: self.n_nodes]
+
+    @property
+    def right(self) -> np.ndarray:
+        return self._right[: self.n_nodes]
+
+    @property
+    def thresholds(self) -> np.ndarray:
+        return self._thresholds[: self.n_nodes]
+
+    @property
+    def depth(self) -> np.ndarray:
+        return self._depth[: self.n_nodes]
+
+    def get_node_id(self, node: Node) -> int:
+        return self.node_to_id[id(node)]
 
     def insert_node(self, node: Node) -> int:
         """
@@ -45,33 +80,80 @@ class FlatTree:
         Returns:
             np.int64: The ID assigned to the inserted node.
         """
-        node_id = len(self.id_to_node)
-        self.id_to_node.append(node)
+        if self._free_ids:
+            node_id = self._free_ids.pop()
+            self.id_to_node[node_id] = node
+        else:
+            node_id = self.n_nodes
+            self._reserve(node_id + 1)
+            self.id_to_node.append(node)
+            self.n_nodes += 1
         self.node_to_id[id(node)] = node_id
 
-        self.left.append(-1)
-        self.right.append(-1)
-        self.thresholds.append(np.nan)
-        self.depth.append(node.depth)
+        self._left[node_id] = -1
+        self._right[node_id] = -1
+        self._thresholds[node_id] = np.nan
+        self._depth[node_id] = node.depth
 
         return node_id
 
     def split_node(
         self, node: Node, left_node: Node, right_node: Node, threshold: float
-    ) -> None:
+    ) -> tuple[int, int]:
         """
         Split a node into left and right children in the flattened tree representation.
 
         Args:
-            node_id (np.int64): The ID of the node to be split.
-            left_id (np.int64): The ID of the left child node.
-            right_id (np.int64): The ID of the right child node.
+            node (Node): The node to be split.
+            left_node (Node): The left child node.
+            right_node (Node): The right child node.
             threshold (float): The hyperplane threshold for the split.
+
+        Returns:
+            tuple[int, int]: The IDs of the left and right child nodes.
         """
         node_id = self.node_to_id[id(node)]
         left_id = self.insert_node(left_node)
         right_id = self.insert_node(right_node)
 
-        self.left[node_id] = left_id
-        self.right[node_id] = right_id
-        self.thresholds[node_id] = threshold
+        self._left[node_id] = left_id
+        self._right[node_id] = right_id
+        self._thresholds[node_id] = threshold
+
+        return left_id, right_id
+
+    def collapse_node(self, node: Node) -> None:
+        """
+        Turn an internal node whose children are leaves back into a leaf and
+        release the slots of its children.
+
+        Args:
+            node (Node): The internal node to be collapsed.
+        """
+        node_id = self.node_to_id[id(node)]
+        for child_id in (self._left[node_id], self._right[node_id]):
+            child = self.id_to_node[child_id]
+            del self.node_to_id[id(child)]
+            self.id_to_node[child_id] = None
+            self._free_ids.append(int(child_id))
+
+        self._left[node_id] = -1
+        self._right[node_id] = -1
+        self._thresholds[node_id] = np.nan
+
+    def _reserve(self, n_nodes: int) -> None:
+        capacity = self._left.shape[0]
+        if n_nodes <= capacity:
+            return
+
+        new_capacity = max(2 * capacity, n_nodes)
+        self._left = _grow(self._left, new_capacity, -1)
+        self._right = _grow(self._right, new_capacity, -1)
+        self._thresholds = _grow(self._thresholds, new_capacity, np.nan)
+        self._depth = _grow(self._depth, new_capacity, 0)
+
+
+def _grow(array: np.ndarray, capacity: int, fill_value) -> np.ndarray:
+    grown = np.full(capacity, fill_value, dtype=array.dtype)
+    grown[: array.shape[0]] = array
+    return grown
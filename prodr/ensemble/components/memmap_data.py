@@ -0,0 +1,165 @@
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+
+from .data import ProgressiveDataStorage
+
+_STARTS_DTYPE = np.dtype("<i8")
+
+
+@dataclass
+class MemmapDataStorage(ProgressiveDataStorage):
+    """
+    A ProgressiveDataStorage backed by an append-only memory-mapped file.
+
+    Rows are written to `path` and paged in on demand, so the dataset does not
+    have to fit in memory. The file is preallocated to `initial_capacity` rows
+    and grown geometrically in place. The number of rows, features, the dtype and
+    the precision policy are kept in a sidecar `<path>.json` file, and the first
+    id of every batch in the append-only int64 file `<path>.starts`, so the
+    storage can be reopened with `MemmapDataStorage.open`. Each append writes a
+    constant amount of metadata.
+    Attributes:
+        path (str | os.PathLike | None): Path of the backing file.
+    """
+
+    path: str | os.PathLike | None = None
+
+    # Number of batch starts in the starts file, expired ones included.
+    _n_saved_starts: int = field(default=0, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        if self.path is None:
+            raise ValueError("MemmapDataStorage requires a path.")
+
+    @property
+    def meta_path(self) -> str:
+        return f"{os.fspath(self.path)}.json"  # type: ignore
+
+    @property
+    def starts_path(self) -> str:
+        return f"{os.fspath(self.path)}.starts"  # type: ignore
+
+    @classmethod
+    def exists(cls, path: str | os.PathLike) -> bool:
+        return os.path.exists(path) and os.path.exists(f"{os.fspath(path)}.json")
+
+    @classmethod
+    def open(cls, path: str | os.PathLike, **kwargs) -> "MemmapDataStorage":
+        """
+        Reopen a storage written by a previous process.
+        Args:
+            path (str | os.PathLike): Path of the backing file.
+        Returns:
+            MemmapDataStorage: Storage holding the previously appended rows.
+        """
+        with open(f"{os.fspath(path)}.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        storage = cls(
+            path=path,
+            n_features=meta["n_features"],
+            dtype=np.dtype(meta["dtype"]),
+            precision=meta.get("precision"),
+            **kwargs,
+        )
+        if meta.get("scale") is not None:
+            storage._scale = np.asarray(meta["scale"], dtype=np.float32)
+        capacity = os.path.getsize(path) // (
+            storage.dtype.itemsize * storage.n_features  # type: ignore
+        )
+        storage._X = np.memmap(
+            path,
+            dtype=storage.dtype,
+            mode="r+",
+            shape=(capacity, storage.n_features),  # type: ignore
+        )
+        storage._n_samples = meta["n_samples"]
+        storage._offset = meta.get("offset", 0)
+        storage._base = meta.get("base", 0)
+
+        starts = np.fromfile(storage.starts_path, dtype=_STARTS_DTYPE)
+        storage._n_saved_starts = starts.shape[0]
+        # Starts past `n_samples` belong to an append the sidecar never recorded.
+        live = (starts >= storage._offset) & (starts < storage._n_samples)
+        storage._starts = starts[live].tolist()
+
+        return storage
+
+    def share(self, buffer_dir: str | None = None) -> None:
+        """
+        The rows already live in the backing file, which other processes map.
+        """
+
+    def append_block(self, source: Any) -> tuple[int, int]:
+        start, copied_bytes = super().append_block(source)
+        with open(self.starts_path, "ab") as f:
+            f.write(np.asarray([start], dtype=_STARTS_DTYPE).tobytes())
+        self._n_saved_starts += 1
+        self.flush()
+
+        return start, copied_bytes
+
+    def evict(self, offset: int) -> None:
+        super().evict(offset)
+        # Rewrite the starts file once expired starts make up most of it.
+        if self._n_saved_starts > 2 * len(self._starts):
+            tmp_path = f"{self.starts_path}.tmp"
+            np.asarray(self._starts, dtype=_STARTS_DTYPE).tofile(tmp_path)
+            os.replace(tmp_path, self.starts_path)
+            self._n_saved_starts = len(self._starts)
+        self.flush()
+
+    def flush(self) -> None:
+        """
+        Flush written rows to disk and record the current size in the sidecar file.
+        """
+        if self._X is None:
+            return
+        self._X.flush()  # type: ignore
+
+        meta = {
+            "n_features": self.n_features,
+            "dtype": np.dtype(self.dtype).str,
+            "n_samples": self._n_samples,
+            "offset": self._offset,
+            "base": self._base,
+            "precision": self.precision,
+            "scale": self._scale.tolist() if self._scale is not None else None,
+        }
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _buffer_path(self, name: str) -> str:
+        return os.fspath(self.path)  # type: ignore
+
+    def _allocate(self, capacity: int) -> tuple[np.ndarray, int]:
+        nbytes = capacity * self.n_features * np.dtype(self.dtype).itemsize  # type: ignore
+
+        if self._X is None:
+            with open(self.path, "wb") as f:  # type: ignore
+                f.truncate(nbytes)
+            open(self.starts_path, "wb").close()
+        else:
+            self._X.flush()  # type: ignore
+            with open(self.path, "r+b") as f:  # type: ignore
+                f.truncate(nbytes)
+
+        X = np.memmap(
+            self.path,  # type: ignore
+            dtype=self.dtype,
+            mode="r+",
+            shape=(capacity, self.n_features),  # type: ignore
+        )
+        if self._offset == self._base:
+            return X, 0
+
+        live = X[self._offset - self._base : self._n_samples - self._base]
+        X[: live.shape[0]] = live
+        return X, live.nbytes
@@ -1,18 +1,24 @@
 from __future__ import annotations
-from typing import Optional
+from typing import Optional, Sequence
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+import numpy as np
 
 from .hyperplane import Hyperplane
 
 
-@dataclass
+@dataclass(eq=False)
 class Node:
     """
     Represents a node in an adaptive partitioning tree.
+
+    `indices` holds the ids of the data points in a leaf as an int64 array. It is
+    a view on a private buffer with spare capacity, so `add_indices` appends in
+    amortized O(1) per point.
     """
 
-    indices: list[int]
+    indices: np.ndarray
     depth: int
     is_leaf: bool = True
 
@@ -21,10 +27,36 @@ class Node:
     _left: Optional[Node] = None
     _right: Optional[Node] = None
     _hyperplane: Optional[Hyperplane] = None
+    _buffer: Optional[np.ndarray] = field(default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        self.indices = np.asarray(self.indices, dtype=np.int64)
 
     def is_root(self) -> bool:
         return self.parent is None
 
+    @property
+    def size(self) -> int:
+        return self.indices.shape[0]
+
+    def add_indices(self, indices: np.ndarray | Sequence[int]) -> None:
+        """
+        Append data point ids to the node.
+        Args:
+            indices (np.ndarray | Sequence[int]): Ids to append.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        n, m = self.size, self.size + indices.shape[0]
+
+        buffer = self._buffer
+        if buffer is None or self.indices.base is not buffer or buffer.shape[0] < m:
+            buffer = np.empty(max(2 * m, 16), dtype=np.int64)
+            buffer[:n] = self.indices
+            self._buffer = buffer
+
+        buffer[n:m] = indices
+        self.indices = buffer[:m]
+
     @property
     def left(self) -> Node:
         if self._left is None:
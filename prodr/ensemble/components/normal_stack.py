@@ -0,0 +1,137 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import scipy.sparse as sp
+
+
+@dataclass
+class NormalStack:
+    """
+    The normal vectors of every tree of a forest stacked into one matrix, so an
+    incoming batch is projected onto all of them with a single GEMM.
+
+    Normals are laid out as (n_trees, depth_capacity, n_features); the rows of a
+    tree past its depth are zero. The projections of tree `t` are then the view
+    `P[:, t, :depth_t]` of the (n_samples, n_trees, depth_capacity) result.
+
+    With `sparse=True` the trees' normals are CSR matrices and the stack is a
+    single (n_trees * depth_capacity, n_features) CSR matrix, rebuilt after
+    normals were appended, so the projection only touches nonzero coordinates.
+    Attributes:
+        n_trees (int): Number of trees.
+        n_features (int): Number of features of the normals.
+        dtype (np.dtype): Data type of the normals.
+        sparse (bool): Whether the normals are sparse.
+    """
+
+    n_trees: int
+    n_features: int
+    dtype: np.dtype = field(default_factory=lambda: np.dtype(np.float64))
+    sparse: bool = False
+
+    _normals: np.ndarray = field(init=False, repr=False)
+    _depths: np.ndarray = field(init=False, repr=False)
+    _sparse_normals: list[sp.csr_array | None] = field(init=False, repr=False)
+    _matrix: sp.csr_array | None = field(default=None, init=False, repr=False)
+    _capacity: int = field(default=0, init=False)
+
+    def __post_init__(self) -> None:
+        self._normals = np.zeros((self.n_trees, 0, self.n_features), dtype=self.dtype)
+        self._depths = np.zeros(self.n_trees, dtype=np.int64)
+        self._sparse_normals = [None] * self.n_trees
+
+    @property
+    def depths(self) -> np.ndarray:
+        return self._depths
+
+    @property
+    def depth_capacity(self) -> int:
+        return self._capacity
+
+    def sync(self, tree: int, normals: np.ndarray | sp.csr_array) -> None:
+        """
+        Copy the normals a tree appended since the last call into the stack.
+        Args:
+            tree (int): Index of the tree.
+            normals (np.ndarray | sp.csr_array): All normals of the tree, shape
+                (depth, n_features).
+        """
+        depth = self._depths[tree]
+        n_normals = normals.shape[0]
+        if n_normals <= depth:
+            return
+
+        self._reserve(n_normals)
+        if self.sparse:
+            self._sparse_normals[tree] = normals  # type: ignore
+            self._matrix = None
+        else:
+            self._normals[tree, depth:n_normals] = normals[depth:]
+        self._depths[tree] = n_normals
+
+    def project(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Project a batch onto the normals of every tree.
+        Args:
+            batch (np.ndarray | sp.csr_array): Data points of shape
+                (n_samples, n_features), dense or CSR.
+        Returns:
+            np.ndarray: Projections of shape (n_samples, n_trees, depth_capacity).
+        """
+        if self.sparse:
+            projections = self._sparse_matrix() @ batch.T
+            if sp.issparse(projections):
+                projections = projections.toarray()  # type: ignore
+            projections = np.ascontiguousarray(projections.T)
+        else:
+            normals = self._normals.reshape(-1, self.n_features)
+            projections = batch @ normals.T
+
+        return projections.reshape(batch.shape[0], self.n_trees, self._capacity)
+
+    def tree_projections(self, projections: np.ndarray, tree: int) -> np.ndarray:
+        """
+        View on the projections of one tree, shape (n_samples, depth).
+        """
+        return projections[:, tree, : self._depths[tree]]
+
+    def _sparse_matrix(self) -> sp.csr_array:
+        if self._matrix is None:
+            capacity = self.depth_capacity
+            empty = np.empty(0, dtype=np.int64)
+            data, rows, cols = [np.empty(0, dtype=self.dtype)], [empty], [empty]
+            for t, normals in enumerate(self._sparse_normals):
+                if normals is None:
+                    continue
+                block = normals.tocoo()
+                data.append(block.data)
+                rows.append(block.row + t * capacity)
+                cols.append(block.col)
+
+            self._matrix = sp.csr_array(
+                (
+                    np.concatenate(data),
+                    (
+                        np.concatenate(rows),
+                        np.concatenate(cols),
+                    ),
+                ),
+                shape=(self.n_trees * capacity, self.n_features),
+            )
+        return self._matrix
+
+    def _reserve(self, depth: int) -> None:
+        # Depth grows logarithmically with the data, so the stack is kept exactly
+        # as deep as the deepest tree and no GEMM columns are wasted on slack.
+        capacity = self._capacity
+        if depth <= capacity:
+            return
+
+        self._capacity = depth
+        if self.sparse:
+            self._matrix = None
+            return
+
+        normals = np.zeros((self.n_trees, depth, self.n_features), dtype=self.dtype)
+        normals[:, :capacity] = self._normals
+        self._normals = normals
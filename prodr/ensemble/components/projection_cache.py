@@ -0,0 +1,108 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+@dataclass
+class ProjectionCache:
+    """
+    Projections of data points onto the normal vectors of a tree, indexed by
+    (depth, data point id).
+
+    Columns are stored contiguously per depth so that splitting a leaf only
+    gathers one value per point. Entries that have not been computed yet, e.g.
+    for points inserted before the normal of a depth existed, are NaN.
+
+    The cache takes n_samples x depth x `dtype.itemsize` bytes, always in RAM.
+    Attributes:
+        dtype (np.dtype): Data type of the projections, the compute dtype of the
+            storage.
+        initial_capacity (int): Number of rows reserved on the first append.
+    """
+
+    dtype: np.dtype
+    initial_capacity: int = 1024
+
+    _P: np.ndarray | None = field(default=None, init=False, repr=False)
+    _n_columns: int = field(default=0, init=False)
+    _base: int = field(default=0, init=False)
+    _offset: int = field(default=0, init=False)
+    _end: int = field(default=0, init=False)
+
+    @property
+    def n_columns(self) -> int:
+        return self._n_columns
+
+    def append(self, start_idx: int, projections: np.ndarray) -> None:
+        """
+        Store the projections of the data points with ids starting at `start_idx`.
+        Args:
+            start_idx (int): Id of the first data point.
+            projections (np.ndarray): Projections of shape (n_samples, n_columns).
+        """
+        if self._end == self._offset:
+            self._base = self._offset = self._end = start_idx
+
+        n_samples, n_columns = projections.shape
+        self._n_columns = max(self._n_columns, n_columns)
+        end = start_idx + n_samples
+        self._reserve(self._n_columns, end)
+
+        rows = slice(start_idx - self._base, end - self._base)
+        self._P[:n_columns, rows] = projections.T  # type: ignore
+        self._P[n_columns : self._n_columns, rows] = np.nan  # type: ignore
+        self._end = end
+
+    def add_column(self) -> int:
+        """
+        Add a column for a new normal vector. Every entry starts out missing.
+        Returns:
+            int: Index of the new column.
+        """
+        column = self._n_columns
+        self._n_columns += 1
+        self._reserve(self._n_columns, self._end)
+        self._P[column, : self._end - self._base] = np.nan  # type: ignore
+
+        return column
+
+    def get(self, indices: np.ndarray, column: int) -> np.ndarray:
+        return self._P[column, indices - self._base]  # type: ignore
+
+    def set(self, indices: np.ndarray, column: int, values: np.ndarray) -> None:
+        self._P[column, indices - self._base] = values  # type: ignore
+
+    def evict(self, offset: int) -> None:
+        """
+        Drop the projections of every data point with an id below `offset`.
+        Their slots are reused the next time the cache fills up.
+        """
+        self._offset = max(self._offset, min(offset, self._end))
+
+    def _reserve(self, n_columns: int, end: int) -> None:
+        """
+        Make sure the cache can hold `n_columns` columns and the ids below `end`.
+        """
+        columns_capacity = self._P.shape[0] if self._P is not None else 0
+        rows_capacity = self._P.shape[1] if self._P is not None else 0
+        if n_columns <= columns_capacity and end - self._base <= rows_capacity:
+            return
+
+        n_live = end - self._offset
+        if n_columns <= columns_capacity and 2 * n_live <= rows_capacity:
+            live = self._P[:, self._offset - self._base : self._end - self._base]  # type: ignore
+            self._P[:, : live.shape[1]] = live  # type: ignore
+            self._base = self._offset
+            return
+
+        if n_columns > columns_capacity:
+            columns_capacity = max(2 * columns_capacity, n_columns, 8)
+        if end - self._base > rows_capacity and 2 * n_live > rows_capacity:
+            rows_capacity = max(2 * rows_capacity, 2 * n_live, self.initial_capacity)
+
+        P = np.empty((columns_capacity, rows_capacity), dtype=self.dtype)
+        if self._P is not None:
+            live = self._P[:, self._offset - self._base : self._end - self._base]
+            P[: live.shape[0], : live.shape[1]] = live
+        self._P = P
+        self._base = self._offset
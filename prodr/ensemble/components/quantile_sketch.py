@@ -0,0 +1,100 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+@dataclass
+class QuantileSketch:
+    """
+    A mergeable streaming quantile sketch (a simplified KLL sketch).
+
+    Values are kept in levels; an item at level `h` stands for 2**h inserted
+    values. When a level holds more than `k` items it is sorted and every other
+    item, starting at a random position, is promoted to the next level. The
+    memory is O(k log(n / k)) and the rank error is O(1 / k).
+    Attributes:
+        k (int): Capacity of each level.
+        seed (int | None): Seed for the choice of the promoted items.
+    """
+
+    k: int = 128
+    seed: int | None = None
+
+    _levels: list[np.ndarray] = field(default_factory=list, init=False, repr=False)
+    _n: int = field(default=0, init=False)
+    _rng: np.random.Generator = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._rng = np.random.default_rng(self.seed)
+
+    @property
+    def n(self) -> int:
+        return self._n
+
+    def update(self, values: np.ndarray) -> None:
+        """
+        Add values to the sketch.
+        Args:
+            values (np.ndarray): Values to add, shape (n_values,).
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return
+
+        self._n += values.size
+        self._add(0, values)
+        self._compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """
+        Merge another sketch into this one.
+        Args:
+            other (QuantileSketch): The sketch to merge.
+        """
+        self._n += other._n
+        for h, items in enumerate(other._levels):
+            self._add(h, items)
+        self._compress()
+
+    def quantile(self, q: float) -> float:
+        """
+        Approximate the q-quantile of the values added so far.
+        Args:
+            q (float): Quantile in [0, 1].
+        Returns:
+            float: The approximate quantile, NaN if the sketch is empty.
+        """
+        if self._n == 0:
+            return np.nan
+
+        items = np.concatenate(self._levels)
+        weights = np.concatenate(
+            [
+                np.full(level.size, 2**h, dtype=np.int64)
+                for h, level in enumerate(self._levels)
+            ]
+        )
+        order = np.argsort(items, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        rank = np.searchsorted(cumulative, q * cumulative[-1], side="left")
+
+        return float(items[order[min(rank, order.size - 1)]])
+
+    def _add(self, h: int, items: np.ndarray) -> None:
+        while len(self._levels) <= h:
+            self._levels.append(np.empty(0, dtype=np.float64))
+        self._levels[h] = np.concatenate([self._levels[h], items])
+
+    def _compress(self) -> None:
+        h = 0
+        while h < len(self._levels):
+            level = self._levels[h]
+            if level.size > self.k:
+                level = np.sort(level)
+                # An odd item out stays at its level so weights are preserved.
+                keep = level[-1:] if level.size % 2 else level[:0]
+                pairs = level[: level.size - keep.size]
+                start = int(self._rng.integers(2))
+                self._levels[h] = keep
+                self._add(h + 1, pairs[start::2])
+            h += 1
@@ -0,0 +1,249 @@
+from dataclasses import dataclass, field
+from typing import Any, Sequence
+
+import numpy as np
+import scipy.sparse as sp
+
+from prodr.ensemble.validators import check_feature_dim, check_dtype
+
+from .data import ProgressiveDataStorage
+
+
+@dataclass
+class SparseDataStorage(ProgressiveDataStorage):
+    """
+    A ProgressiveDataStorage for scipy.sparse CSR batches.
+
+    Rows are appended to growable CSR arrays (row pointers, column indices and
+    values), so memory scales with the number of nonzeros rather than
+    n_samples x n_features. Rows are read back as CSR arrays; `take` gathers a
+    dense block restricted to a few columns. Ids and eviction work as in
+    ProgressiveDataStorage. The "int8" precision is not supported.
+    """
+
+    initial_nnz_capacity: int = 4096
+
+    _indptr: np.ndarray | None = field(default=None, init=False, repr=False)
+    _indices: np.ndarray | None = field(default=None, init=False, repr=False)
+    _values: np.ndarray | None = field(default=None, init=False, repr=False)
+
+    _BUFFERS = ("_indptr", "_indices", "_values")
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        if self.precision == "int8":
+            raise ValueError("SparseDataStorage does not support the int8 precision.")
+
+    @property
+    def capacity(self) -> int:
+        return self._indptr.shape[0] - 1 if self._indptr is not None else 0
+
+    @property
+    def nnz(self) -> int:
+        """
+        Number of stored nonzeros of the live rows.
+        """
+        if self._indptr is None:
+            return 0
+        indptr = self._indptr
+        return int(
+            indptr[self._n_samples - self._base] - indptr[self._offset - self._base]
+        )
+
+    def append_block(self, source: Any) -> tuple[int, int]:
+        """
+        Append a CSR batch. Dense batches are converted to CSR first.
+        Args:
+            source (Any): A scipy.sparse matrix / array or a dense 2D array.
+        Returns:
+            tuple[int, int]: Index of the first appended row and the number of bytes
+            copied (conversions, buffer growth and the write into the buffer).
+        """
+        copied_bytes = 0
+        if sp.issparse(source) and source.format == "csr":
+            batch = source
+        else:
+            batch = sp.csr_array(source)
+            copied_bytes += batch.data.nbytes + batch.indices.nbytes
+
+        if self.n_features is None:
+            self.n_features = batch.shape[1]
+            self.dtype = self._storage_dtype(batch.dtype)
+        else:
+            check_feature_dim(batch, self.n_features)  # type: ignore
+            check_dtype(self._storage_dtype(batch.dtype), self.dtype)
+
+        start = self._n_samples
+        end = start + batch.shape[0]
+        nnz_start = (
+            int(self._indptr[start - self._base]) if self._indptr is not None else 0
+        )
+        copied_bytes += self._reserve_nnz(end, nnz_start + batch.nnz)
+
+        nnz_start = int(self._indptr[start - self._base])  # type: ignore
+        nnz_end = nnz_start + batch.nnz
+        self._indptr[start - self._base + 1 : end - self._base + 1] = (  # type: ignore
+            batch.indptr[1:] + nnz_start
+        )
+        self._indices[nnz_start:nnz_end] = batch.indices  # type: ignore
+        self._values[nnz_start:nnz_end] = batch.data  # type: ignore
+        copied_bytes += batch.indptr.nbytes + batch.indices.nbytes + batch.data.nbytes
+
+        self._starts.append(start)
+        self._n_samples = end
+
+        return start, copied_bytes
+
+    def _reserve_nnz(self, n_rows: int, nnz_end: int) -> int:
+        """
+        Make sure the buffers can hold the rows with ids below `n_rows` and
+        `nnz_end` nonzeros. Expired rows are dropped from the front first when
+        that frees enough room; otherwise the buffers grow geometrically.
+        Returns:
+            int: Number of bytes copied to compact or grow the buffers.
+        """
+        row_capacity = self.capacity
+        nnz_capacity = self._indices.shape[0] if self._indices is not None else 0
+        if (
+            self._indptr is not None
+            and n_rows - self._base <= row_capacity
+            and nnz_end <= nnz_capacity
+        ):
+            return 0
+
+        live_nnz_start = (
+            int(self._indptr[self._offset - self._base])
+            if self._indptr is not None
+            else 0
+        )
+        n_live = n_rows - self._offset
+        nnz_live = nnz_end - live_nnz_start
+        gf = self.growth_factor
+
+        if (
+            self._offset > self._base
+            and n_live * gf <= row_capacity
+            and nnz_live * gf <= nnz_capacity
+        ):
+            copied_bytes = self._compact()
+        else:
+            row_capacity = self._grow(row_capacity, n_live, self.initial_capacity)
+            nnz_capacity = self._grow(nnz_capacity, nnz_live, self.initial_nnz_capacity)
+            copied_bytes = self._allocate_sparse(row_capacity, nnz_capacity)
+
+        self._base = self._offset
+
+        return copied_bytes
+
+    def _grow(self, capacity: int, required: int, initial: int) -> int:
+        capacity = max(capacity, initial, 1)
+        while capacity < required:
+            capacity = max(int(capacity * self.growth_factor), capacity + 1)
+        return capacity
+
+    def _live_slices(self) -> tuple[slice, slice]:
+        rows = slice(self._offset - self._base, self._n_samples - self._base + 1)
+        indptr = self._indptr
+        nnz = slice(int(indptr[rows.start]), int(indptr[rows.stop - 1]))  # type: ignore
+        return rows, nnz
+
+    def _compact(self) -> int:
+        """
+        Move the live rows to the front of the buffers.
+        Returns:
+            int: Number of bytes copied.
+        """
+        rows, nnz = self._live_slices()
+        indptr = self._indptr[rows] - nnz.start  # type: ignore
+        n_nnz = nnz.stop - nnz.start
+
+        self._indptr[: indptr.shape[0]] = indptr  # type: ignore
+        self._indices[:n_nnz] = self._indices[nnz]  # type: ignore
+        self._values[:n_nnz] = self._values[nnz]  # type: ignore
+
+        return indptr.nbytes + n_nnz * (self._indices.itemsize + self._values.itemsize)  # type: ignore
+
+    def _allocate_sparse(self, row_capacity: int, nnz_capacity: int) -> int:
+        """
+        Allocate buffers holding the live rows at their front.
+        Returns:
+            int: Number of bytes copied into them.
+        """
+        indptr = self._new_buffer("_indptr", (row_capacity + 1,), np.int64, zero=True)
+        indices = self._new_buffer("_indices", (nnz_capacity,), np.int32)
+        values = self._new_buffer("_values", (nnz_capacity,), self.dtype)
+
+        copied_bytes = 0
+        if self._indptr is not None:
+            rows, nnz = self._live_slices()
+            live_indptr = self._indptr[rows] - nnz.start
+            n_nnz = nnz.stop - nnz.start
+            indptr[: live_indptr.shape[0]] = live_indptr
+            indices[:n_nnz] = self._indices[nnz]  # type: ignore
+            values[:n_nnz] = self._values[nnz]  # type: ignore
+            copied_bytes = live_indptr.nbytes + n_nnz * (
+                indices.itemsize + values.itemsize
+            )
+
+        self._indptr, self._indices, self._values = indptr, indices, values
+        return copied_bytes
+
+    def _reallocate(self) -> None:
+        if self._indptr is not None:
+            self._allocate_sparse(self.capacity, self._indices.shape[0])  # type: ignore
+            self._base = self._offset
+
+    def _live_matrix(self) -> sp.csr_array:
+        rows, nnz = self._live_slices()
+        return sp.csr_array(
+            (
+                self._values[nnz],  # type: ignore
+                self._indices[nnz],  # type: ignore
+                self._indptr[rows] - nnz.start,
+            ),
+            shape=(self.n_live, self.n_features),
+        )
+
+    def _gather_rows(self, local_rows: np.ndarray) -> sp.csr_array:
+        """
+        Gather live rows into a new CSR array, touching only their nonzeros.
+        """
+        rows = local_rows + (self._offset - self._base)
+        starts = self._indptr[rows]  # type: ignore
+        lengths = self._indptr[rows + 1] - starts  # type: ignore
+        indptr = np.zeros(rows.shape[0] + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+
+        return sp.csr_array(
+            (self._values[positions], self._indices[positions], indptr),  # type: ignore
+            shape=(rows.shape[0], self.n_features),
+        )
+
+    def take(
+        self, rows: np.ndarray | Sequence[int], columns: np.ndarray | Sequence[int]
+    ) -> np.ndarray:
+        """
+        Gather a dense block of rows restricted to some columns.
+        Args:
+            rows (np.ndarray | Sequence[int]): Global row ids.
+            columns (np.ndarray | Sequence[int]): Column indices.
+        Returns:
+            np.ndarray: The block, shape (len(rows), len(columns)).
+        """
+        if self._indptr is None:
+            raise ValueError("No data available.")
+        block = self._gather_rows(np.asarray(self._to_local(rows), dtype=np.int64))
+        return self._decode(block[:, np.asarray(columns)].toarray())
+
+    def __getitem__(self, idx: int | slice | np.ndarray | Sequence[int]) -> Any:
+        if self._indptr is None:
+            raise ValueError("No data available.")
+        local = self._to_local(idx)
+        if isinstance(local, (slice, int, np.integer)):
+            return self._decode(self._live_matrix()[local])
+
+        local = np.asarray(local)
+        if local.dtype == bool:
+            local = np.flatnonzero(local)
+        return self._decode(self._gather_rows(local.astype(np.int64, copy=False)))
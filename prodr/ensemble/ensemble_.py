@@ -1,10 +1,21 @@
-from typing import Literal
+from typing import Any, Literal
 import numpy as np
+import scipy.sparse as sp
 
 from .apforest import APForest
 from .cluster_handler import ClusterHandler
-from .components import ProgressiveDataStorage, MicroCluster
-from .types import ClusterUpdateEvent
+from .components import (
+    MemmapDataStorage,
+    MicroCluster,
+    ProgressiveDataStorage,
+    SparseDataStorage,
+)
+from .validators import check_feature_dim
+from .types import (
+    ClusterUpdateEvent,
+    MicroClusterRemovalEvent,
+    MicroClusterSplitEvent,
+)
 
 
 class Ensemble:
@@ -14,8 +25,43 @@ class Ensemble:
         n_trees (int): Number of trees in the ensemble.
         leaf_max_size (int): Maximum size of leaf nodes in each tree.
         threshold (int): Threshold for micro-cluster operations.
-        b_strategy (str): Strategy for generating hyperplanes ("euclidean" or "cosine
+        b_strategy (str): How split offsets are chosen: "default" (median, also
+            "euclidean" or "cosine"), "exact" (single np.partition), "sampled"
+            (median of a bounded sample) or "sketch" (per-leaf quantile sketch).
         seed (int): Random seed for reproducibility.
+        storage (str | ProgressiveDataStorage): Storage backend ("memory", "memmap"
+            or "sparse" for scipy.sparse CSR batches), or an already constructed
+            storage. Rows already present in the storage (e.g. a reopened memmap
+            file) are inserted on construction.
+        storage_path (str | None): Backing file for the "memmap" storage. An existing
+            file is reopened instead of being overwritten.
+        precision (str | None): Dtype policy applied at ingestion ("float32", "float16"
+            or "int8" with a per-feature scale). Normals, projections and offsets are
+            then computed in float32. None keeps the input dtype and float64 normals.
+        window (int | None): Size of the sliding window. Older data points are
+            evicted from the storage, the trees and the micro-clusters before each
+            update. None keeps every data point.
+        window_unit (str): Unit of `window`, either "points" or "batches".
+        projection_cache (bool): Whether each tree caches the projections of every
+            data point onto its normals, so that splitting a leaf does not gather
+            full data rows. The cache holds n_samples x depth floats per tree
+            (float32 with `precision`, float64 otherwise), in RAM even with the
+            "memmap" storage, so it can outgrow the data itself. Off by default.
+        executor (str): "thread" grows the trees in a thread pool; "process" grows
+            them in spawned worker processes that map the storage (see APForest),
+            so the calling script needs an `if __name__ == "__main__":` guard.
+        n_workers (int | None): Number of worker processes of the "process"
+            executor. Defaults to the number of trees processed concurrently.
+        normal_family (str): "gaussian" for dense normals or "sparse" for very sparse
+            +-1 normals, which make projections several times cheaper for
+            high-dimensional inputs.
+        n_jobs (int | None): Total thread budget shared by the tree-level fan-out,
+            BLAS and numba. None uses every CPU, -1 as well, -2 all but one.
+        max_splits (int | None): Maximum number of leaf splits per tree and update.
+            Overflowing leaves beyond it are split by later updates or `flush`.
+        split_time_budget (float | None): Time budget of the splits of an update,
+            in seconds, with the same deferral. Every tree still makes at least
+            one split per update.
         data (ProgressiveDataStorage): Storage for progressive data points.
         forest (APForest): The ensemble of APTrees.
         cluster_handler (EnsembleClusterHandler): Handler for managing micro-clusters.
@@ -26,16 +72,50 @@ class Ensemble:
         n_trees: int = 8,
         leaf_max_size: int = 128,
         threshold: int | Literal["default"] = "default",
-        b_strategy: Literal["euclidean", "cosine"] = "euclidean",
+        b_strategy: Literal[
+            "default", "euclidean", "cosine", "exact", "sampled", "sketch"
+        ] = "euclidean",
         seed: int = 42,
+        storage: (
+            Literal["memory", "memmap", "sparse"] | ProgressiveDataStorage
+        ) = "memory",
+        storage_path: str | None = None,
+        precision: Literal["float32", "float16", "int8"] | None = None,
+        window: int | None = None,
+        window_unit: Literal["points", "batches"] = "points",
+        projection_cache: bool = False,
+        executor: Literal["thread", "process"] = "thread",
+        n_workers: int | None = None,
+        n_jobs: int | None = None,
+        normal_family: Literal["gaussian", "sparse"] = "gaussian",
+        max_splits: int | None = None,
+        split_time_budget: float | None = None,
     ) -> None:
         self.n_trees = n_trees
         self.leaf_max_size = leaf_max_size
         self.threshold: int = threshold if threshold != "default" else n_trees // 2 + 1
         self.b_strategy = b_strategy
         self.seed = seed
+        self.precision = precision
+        self.window = window
+        self.window_unit = window_unit
+        self.projection_cache = projection_cache
+        self.executor = executor
+        self.n_jobs = n_jobs
+        self.normal_family = normal_family
+        self.max_splits = max_splits
+        self.split_time_budget = split_time_budget
 
-        self.data = ProgressiveDataStorage()
+        if window is not None and window < 1:
+            raise ValueError("window must be a positive integer.")
+        if max_splits is not None and max_splits < 1:
+            raise ValueError("max_splits must be a positive integer.")
+        if split_time_budget is not None and split_time_budget <= 0:
+            raise ValueError("split_time_budget must be positive.")
+        if window_unit not in ("points", "batches"):
+            raise ValueError(f"Unknown window_unit: {window_unit}")
+
+        self.data = self._create_storage(storage, storage_path, precision)
 
         self.forest = APForest(
             data=self.data,
@@ -43,28 +123,176 @@ class Ensemble:
             leaf_max_size=leaf_max_size,
             b_strategy=b_strategy,
             seed=seed,
+            projection_cache=projection_cache,
+            executor=executor,
+            n_workers=n_workers,
+            n_jobs=n_jobs,
+            normal_family=normal_family,
         )
         self.cluster_handler = ClusterHandler(data=self.data, threshold=self.threshold)
 
+        if self.data.n_live > 0:
+            self._ingest(self.data.offset)
+
+    @staticmethod
+    def _create_storage(
+        storage: Literal["memory", "memmap", "sparse"] | ProgressiveDataStorage,
+        storage_path: str | None,
+        precision: Literal["float32", "float16", "int8"] | None,
+    ) -> ProgressiveDataStorage:
+        if isinstance(storage, ProgressiveDataStorage):
+            return storage
+        elif storage == "memory":
+            return ProgressiveDataStorage(precision=precision)
+        elif storage == "memmap":
+            if storage_path is None:
+                raise ValueError("storage_path is required for the memmap storage.")
+            if MemmapDataStorage.exists(storage_path):
+                return MemmapDataStorage.open(storage_path)
+            return MemmapDataStorage(path=storage_path, precision=precision)
+        elif storage == "sparse":
+            return SparseDataStorage(precision=precision)
+        else:
+            raise ValueError(f"Unknown storage: {storage}")
+
     def update(self, batch: np.ndarray) -> ClusterUpdateEvent:
         start_idx = self.data.append(batch)
 
+        return self._ingest(start_idx)
+
+    def update_from(self, source: Any) -> tuple[ClusterUpdateEvent, int]:
+        """
+        Update the ensemble with a block of rows from a numpy array, pandas
+        DataFrame, Arrow RecordBatch / Table or buffer-protocol object, writing
+        its columns straight into the storage buffer.
+        Args:
+            source (Any): The block of rows to insert.
+        Returns:
+            tuple[ClusterUpdateEvent, int]: The cluster updates and the number of
+            bytes copied during ingestion.
+        """
+        start_idx, copied_bytes = self.data.append_block(source)
+
+        return self._ingest(start_idx), copied_bytes
+
+    def _ingest(self, start_idx: int) -> ClusterUpdateEvent:
+        eviction_split_events, mc_removal_events = self._evict(start_idx)
+
         self.forest.insert(start_idx)
-        split_events = self.forest.split()
+        split_events = self.forest.split(self.max_splits, self.split_time_budget)
         all_leaf_nodes = self.forest.get_all_leaf_nodes()
-        forest_id2node = self.forest.get_id_to_node_mappings()
+        forest_leaf_ids = self.forest.get_leaf_ids(start_idx, self.data.size)
+        leaf_tables = self.forest.get_leaf_tables()
 
-        mc_split_events = self.cluster_handler.handle_split(
-            start_idx, all_leaf_nodes, split_events
-        )
-        mc_merge_events, mc_creation_events = self.cluster_handler.handle_insertion(
-            start_idx, forest_id2node
-        )
+        # The cluster handler runs after the fan-out, so its kernels get every thread.
+        with self.forest.budget.limit(self.forest.budget.n_jobs):
+            mc_split_events = self.cluster_handler.handle_split(
+                start_idx, all_leaf_nodes, split_events
+            )
+            mc_merge_events, mc_creation_events = self.cluster_handler.handle_insertion(
+                start_idx, forest_leaf_ids, leaf_tables
+            )
         return ClusterUpdateEvent(
-            split_events=mc_split_events,
+            split_events=eviction_split_events + mc_split_events,
             merge_events=mc_merge_events,
             creation_events=mc_creation_events,
+            removal_events=mc_removal_events,
+            pending_splits=self.forest.n_pending_splits,
         )
 
+    def flush(self) -> ClusterUpdateEvent:
+        """
+        Split every overflowing leaf deferred by the split budget of previous
+        updates.
+        """
+        split_events = self.forest.split()
+        with self.forest.budget.limit(self.forest.budget.n_jobs):
+            mc_split_events = self.cluster_handler.handle_split(
+                self.data.size, self.forest.get_all_leaf_nodes(), split_events
+            )
+        return ClusterUpdateEvent(
+            split_events=mc_split_events, merge_events=[], creation_events=[]
+        )
+
+    def query(
+        self, X: Any, k: int = 10, exact: bool = True
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate k nearest neighbours of a batch of points among the live data
+        points, looked up through the leaves of the forest (see `APForest.query`).
+        Args:
+            X (np.ndarray | sp.csr_array): Query points, shape (n_queries, n_features).
+            k (int): Number of neighbours per query.
+            exact (bool): Whether to rank the candidates by exact distance rather
+                than by the number of trees sharing a leaf with the query.
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Ids of the neighbours, padded with -1,
+            and their distances (or co-leaf counts), both of shape (n_queries, k).
+        """
+        return self.forest.query(X, k=k, exact=exact)
+
+    def predict(self, batch: Any) -> np.ndarray:
+        """
+        Assign a batch of points to the existing micro-clusters without inserting
+        them. Points are routed through the trees and voted for by the data
+        points they share a leaf with in at least `threshold` trees. Nothing is
+        modified, so predictions may run concurrently.
+        Args:
+            batch (np.ndarray | sp.csr_array): Points, shape (n_samples, n_features).
+        Returns:
+            np.ndarray: Head id (`MicroCluster.head`) of the micro-cluster of every
+            point, -1 for points that would start a new micro-cluster.
+        """
+        if not sp.issparse(batch):
+            batch = np.atleast_2d(np.asarray(batch))
+        if self.data.n_live == 0:
+            return np.full(batch.shape[0], -1, dtype=np.int64)
+        check_feature_dim(batch, self.data.n_features)  # type: ignore
+
+        return self.cluster_handler.predict(
+            self.forest.route(batch), self.forest.get_leaf_tables()
+        )
+
+    @property
+    def pending_splits(self) -> int:
+        """
+        Number of overflowing leaves deferred by the split budget.
+        """
+        return self.forest.n_pending_splits
+
+    def _evict(
+        self, start_idx: int
+    ) -> tuple[list[MicroClusterSplitEvent], list[MicroClusterRemovalEvent]]:
+        """
+        Expire the data points that fell out of the window. Points of the batch
+        starting at `start_idx` are never expired before being inserted.
+        """
+        if self.window is None:
+            return [], []
+
+        if self.window_unit == "points":
+            offset = self.data.size - self.window
+        else:
+            batch_starts = self.data.batch_starts
+            offset = (
+                batch_starts[-self.window] if len(batch_starts) > self.window else 0
+            )
+
+        offset = min(offset, start_idx)
+        if offset <= self.data.offset:
+            return [], []
+
+        self.forest.evict(offset)
+        mc_events = self.cluster_handler.evict(offset)
+        self.data.evict(offset)
+
+        return mc_events
+
+    def close(self) -> None:
+        """
+        Release the worker processes and the thread pool of the forest.
+        """
+        self.forest.close()
+
     def get_micro_clusters(self) -> list[MicroCluster]:
         return self.cluster_handler.micro_clusters
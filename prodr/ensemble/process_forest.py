@@ -0,0 +1,336 @@
+import multiprocessing as mp
+import weakref
+from collections import deque
+from typing import Any
+
+import numpy as np
+import scipy.sparse as sp
+
+from .aptree import APTree
+from .components import (
+    Hyperplane,
+    Node,
+    NormalStack,
+    ProgressiveDataStorage,
+    SparseDataStorage,
+)
+from .thread_budget import ThreadBudget
+from .types import InsertionEvent, NodeSplitEvent
+from .utils import stack_normals
+
+# A split is shipped as its offset and the packed left/right mask of the leaf.
+SplitPlan = tuple[float, np.ndarray]
+
+
+class TreeProcessPool:
+    """
+    Worker processes that each own a contiguous block of the trees of a forest.
+
+    Workers read the rows, dense or CSR, straight from the buffers of the
+    storage of the main process, which must be shared (see
+    `ProgressiveDataStorage.share`): every call carries the files and bounds of
+    the buffers, which the workers map read-only, so the rows are never copied
+    to them. Workers send back leaf ids, new normals and split plans, never
+    `Node` objects; the forest replays them on lightweight mirror trees in the
+    main process.
+
+    The `n_jobs` thread budget is divided among the workers, each of which caps
+    its BLAS and numba threads to its share.
+    Attributes:
+        n_workers (int): Number of worker processes.
+    """
+
+    def __init__(
+        self,
+        *,
+        tree_kwargs: list[dict[str, Any]],
+        n_workers: int,
+        n_jobs: int | None = None,
+        mp_context: str | None = None,
+    ) -> None:
+        n_workers = max(1, min(n_workers, len(tree_kwargs)))
+        self.n_workers = n_workers
+        n_threads = max(1, ThreadBudget(n_jobs).n_jobs // n_workers)
+
+        # Forking once numba's parallel threading layer is running leaves the
+        # main process hanging at exit, and workers only need the storage files,
+        # so they are spawned unless another start method is requested.
+        ctx = mp.get_context(mp_context or "spawn")
+        bounds = np.linspace(0, len(tree_kwargs), n_workers + 1).astype(int)
+        self._connections = []
+        self._processes = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker_main,
+                args=(child_conn, tree_kwargs[start:end], n_threads),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._connections.append(parent_conn)
+            self._processes.append(process)
+
+        self._finalizer = weakref.finalize(
+            self, _shutdown, self._connections, self._processes
+        )
+
+    def insert(
+        self, data: ProgressiveDataStorage, start_idx: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Route the rows appended to a shared storage through the trees of every
+        worker.
+        Args:
+            data (ProgressiveDataStorage): The shared storage.
+            start_idx (int): Id of the first new row.
+        Returns:
+            list[tuple[np.ndarray, np.ndarray]]: Per tree, the leaf id of every row
+            and the normals appended since the previous call.
+        """
+        return self._call("insert", _storage_state(data), start_idx)
+
+    def split(
+        self,
+        data: ProgressiveDataStorage,
+        max_splits: int | None = None,
+        time_budget: float | None = None,
+    ) -> list[tuple[np.ndarray, list[SplitPlan]]]:
+        """
+        Split the overflowing leaves of every tree.
+        Args:
+            data (ProgressiveDataStorage): The shared storage.
+            max_splits (int | None): Maximum number of splits per tree.
+            time_budget (float | None): Time budget of each tree, in seconds.
+        Returns:
+            list[tuple[np.ndarray, list[SplitPlan]]]: Per tree, the normals appended
+            during the splits and the plan of every split in order.
+        """
+        return self._call("split", _storage_state(data), max_splits, time_budget)
+
+    def evict(self, offset: int) -> None:
+        self._call("evict", offset)
+
+    def close(self) -> None:
+        self._finalizer()
+
+    def _call(self, command: str, *args: Any) -> list[Any]:
+        for conn in self._connections:
+            conn.send((command, *args))
+
+        # Every reply is received before raising, so that none is left in a pipe
+        # to be read as the answer to the next command.
+        replies = [conn.recv() for conn in self._connections]
+        errors = [payload for status, payload in replies if status == "error"]
+        if errors:
+            raise RuntimeError("Tree worker failed:\n" + "\n".join(errors))
+
+        results = []
+        for _, payload in replies:
+            results.extend(payload)
+
+        return results
+
+
+class _RecordingTree(APTree):
+    """
+    APTree living in a worker process that records the plan of every split.
+    """
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.plans: list[SplitPlan] = []
+
+    def _plan_split(self, node: Node) -> tuple[Hyperplane, np.ndarray]:
+        hyperplane, mask = super()._plan_split(node)
+        self.plans.append((float(hyperplane.offset), np.packbits(mask)))
+
+        return hyperplane, mask
+
+
+class ReplayTree(APTree):
+    """
+    Mirror of a tree owned by a worker process. It holds the same topology and
+    leaf membership, rebuilt from the leaf ids and split plans sent by the
+    worker, without touching the data.
+    """
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(
+            **{**kwargs, "b_strategy": "default", "projection_cache": False}
+        )
+        self._plans: deque[SplitPlan] = deque()
+
+    def apply_insertion(
+        self, start_idx: int, leaf_ids: np.ndarray, normals: np.ndarray
+    ) -> list[InsertionEvent]:
+        self._extend_normals(normals)
+        return self._assign_leaves(leaf_ids, start_idx)
+
+    def apply_splits(
+        self, normals: np.ndarray, plans: list[SplitPlan]
+    ) -> list[NodeSplitEvent]:
+        self._extend_normals(normals)
+        self._plans.extend(plans)
+        # The worker may have stopped early on its split budget; the leaves are
+        # visited in the same order, so replaying its plans stops at the same leaf.
+        split_events = self._split_nodes(max_splits=len(plans))
+        if self._plans:
+            raise RuntimeError("Tree mirror is out of sync with its worker.")
+
+        return split_events
+
+    def _extend_normals(self, normals: np.ndarray) -> None:
+        if normals.shape[0] == 0:
+            return
+        self.normals = stack_normals(self.normals, normals)
+
+    def _plan_split(self, node: Node) -> tuple[Hyperplane, np.ndarray]:
+        offset, packed_mask = self._plans.popleft()
+        mask = np.unpackbits(packed_mask, count=node.size).astype(bool)
+
+        return Hyperplane(normal=self._get_normal(node.depth), offset=offset), mask
+
+
+def _worker_main(conn: Any, tree_kwargs: list[dict[str, Any]], n_threads: int) -> None:
+    with ThreadBudget(n_threads).limit(n_threads):
+        _serve(conn, tree_kwargs)
+
+
+def _serve(conn: Any, tree_kwargs: list[dict[str, Any]]) -> None:
+    data: ProgressiveDataStorage | None = None
+    trees: list[_RecordingTree] = []
+    stack: NormalStack | None = None
+    n_synced = [0] * len(tree_kwargs)
+
+    def new_normals(t: int) -> np.ndarray:
+        normals = trees[t].get_normals()
+        start, n_synced[t] = n_synced[t], normals.shape[0]
+        return normals[start:].copy()
+
+    while True:
+        try:
+            command, *args = conn.recv()
+        except EOFError:
+            break
+
+        try:
+            if command == "insert":
+                state, start_idx = args
+                if data is None:
+                    data = _map_storage(state)
+                    trees = [_RecordingTree(data=data, **kw) for kw in tree_kwargs]
+                else:
+                    _map_storage(state, data)
+
+                if stack is None:
+                    normals = trees[0].get_normals()
+                    stack = NormalStack(
+                        n_trees=len(trees),
+                        n_features=normals.shape[1],
+                        dtype=normals.dtype,
+                        sparse=sp.issparse(normals),
+                    )
+                for t, tree in enumerate(trees):
+                    stack.sync(t, tree.get_normals())
+                projections = stack.project(data[start_idx:])
+
+                result: list[Any] = []
+                for t, tree in enumerate(trees):
+                    tree.insert(start_idx, stack.tree_projections(projections, t))
+                    leaf_ids = tree.get_leaf_ids()[start_idx - tree.get_id_offset() :]
+                    result.append((leaf_ids.copy(), new_normals(t)))
+
+            elif command == "split":
+                state, max_splits, time_budget = args
+                if data is not None:
+                    _map_storage(state, data)
+                result = []
+                for t, tree in enumerate(trees):
+                    tree.split(max_splits, time_budget)
+                    result.append((new_normals(t), tree.plans))
+                    tree.plans = []
+
+            elif command == "evict":
+                (offset,) = args
+                for tree in trees:
+                    tree.evict(offset)
+                result = []
+
+            else:
+                break
+
+            conn.send(("ok", result))
+        except Exception:  # pylint: disable=broad-except
+            import traceback
+
+            conn.send(("error", traceback.format_exc()))
+
+    conn.close()
+
+
+def _storage_state(data: ProgressiveDataStorage) -> tuple:
+    """
+    What a worker needs to read the live rows of a shared storage.
+    """
+    return (
+        isinstance(data, SparseDataStorage),
+        data.n_features,
+        np.dtype(data.dtype).str,
+        data.precision,
+        data.scale,
+        data.size,
+        data.offset,
+        data._base,  # pylint: disable=protected-access
+        data.shared_buffers(),
+    )
+
+
+def _map_storage(
+    state: tuple, data: ProgressiveDataStorage | None = None
+) -> ProgressiveDataStorage:
+    """
+    Create or update a worker's read-only view of a shared storage. Buffers are
+    mapped again only when the main process replaced or grew them.
+    """
+    sparse, n_features, dtype, precision, scale, n_samples, offset, base, buffers = (
+        state
+    )
+    if data is None:
+        storage_cls = SparseDataStorage if sparse else ProgressiveDataStorage
+        data = storage_cls(
+            n_features=n_features, dtype=np.dtype(dtype), precision=precision
+        )
+
+    # pylint: disable=protected-access
+    data._scale, data._n_samples, data._offset, data._base = (
+        scale,
+        n_samples,
+        offset,
+        base,
+    )
+    for name, (path, buffer_dtype, shape) in buffers.items():
+        buffer = getattr(data, name)
+        if (
+            not isinstance(buffer, np.memmap)
+            or buffer.filename != path
+            or buffer.shape != shape
+        ):
+            setattr(
+                data, name, np.memmap(path, dtype=buffer_dtype, mode="r", shape=shape)
+            )
+
+    return data
+
+
+def _shutdown(connections: list[Any], processes: list[Any]) -> None:
+    for conn in connections:
+        try:
+            conn.send(("close",))
+            conn.close()
+        except (OSError, ValueError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
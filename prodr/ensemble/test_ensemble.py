@@ -0,0 +1,28 @@
+import numpy as np
+
+from prodr import Ensemble
+
+
+def test_flush_initialization_then_updates():
+    """
+    With a split budget, the first update leaves too few leaves to initialize
+    the micro-clusters and the deferred splits applied by `flush` initialize
+    them instead. The updates after the flush must still cluster their points.
+    """
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(3000, 16))
+
+    ensemble = Ensemble(n_trees=8, leaf_max_size=32, max_splits=1)
+    ensemble.update(X[:1000])
+    ensemble.flush()
+
+    for start in (1000, 2000):
+        ensemble.update(X[start : start + 1000])
+
+        handler = ensemble.cluster_handler
+        assert sorted(handler.id_to_mc) == list(range(start + 1000))
+        assert sum(mc.size for mc in handler.micro_clusters) == start + 1000
+
+
+if __name__ == "__main__":
+    test_flush_initialization_then_updates()
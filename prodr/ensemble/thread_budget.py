@@ -0,0 +1,89 @@
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, TypeVar
+
+import numba
+from threadpoolctl import ThreadpoolController
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class ThreadBudget:
+    """
+    A single thread budget shared by the tree-level fan-out, BLAS and numba.
+
+    `n_jobs` threads are split between `tree_workers` tasks running concurrently
+    on a persistent thread pool and `inner_threads` BLAS / numba threads per task,
+    so nesting the three never uses more than `n_jobs` cores. Stages that run
+    outside the fan-out, e.g. the forest-wide projection, get all `n_jobs`
+    threads through `limit`.
+    Attributes:
+        n_jobs (int): Total number of threads. None uses every CPU and negative
+            values count back from it (-1 is every CPU, -2 all but one).
+        n_tasks (int): Maximum number of tasks fanned out at once.
+    """
+
+    def __init__(self, n_jobs: int | None = None, n_tasks: int = 1) -> None:
+        n_cpus = os.cpu_count() or 1
+        if n_jobs is None:
+            n_jobs = n_cpus
+        elif n_jobs < 0:
+            n_jobs = max(1, n_cpus + 1 + n_jobs)
+        elif n_jobs == 0:
+            raise ValueError("n_jobs must not be 0.")
+
+        self.n_jobs = n_jobs
+        self.n_tasks = max(1, n_tasks)
+        self.tree_workers = min(self.n_jobs, self.n_tasks)
+        self.inner_threads = max(1, self.n_jobs // self.tree_workers)
+
+        self._executor: ThreadPoolExecutor | None = None
+        self._finalizer: weakref.finalize | None = None
+        self._blas_controller: ThreadpoolController | None = None
+
+    def map(self, fn: Callable[[T], R], items: Iterable[T]) -> list[R]:
+        """
+        Run `fn` over `items` on the persistent pool, with BLAS and numba capped
+        to `inner_threads` while the tasks run.
+        """
+        with self.limit(self.inner_threads):
+            if self.tree_workers == 1:
+                return [fn(item) for item in items]
+            return list(self._get_executor().map(fn, items))
+
+    @contextmanager
+    def limit(self, n_threads: int) -> Iterator[None]:
+        """
+        Cap BLAS and numba to `n_threads` threads within the context. The BLAS
+        limit is process-wide; numba's applies to the calling thread, which is
+        the only one launching parallel kernels (trees use the serial kernel).
+        """
+        previous = numba.get_num_threads()
+        numba.set_num_threads(max(1, min(n_threads, numba.config.NUMBA_NUM_THREADS)))
+        try:
+            with self._get_blas_controller().limit(limits=n_threads, user_api="blas"):
+                yield
+        finally:
+            numba.set_num_threads(previous)
+
+    def close(self) -> None:
+        if self._finalizer is not None:
+            self._finalizer()
+        self._executor = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.tree_workers)
+            self._finalizer = weakref.finalize(
+                self, self._executor.shutdown, wait=False
+            )
+        return self._executor
+
+    def _get_blas_controller(self) -> ThreadpoolController:
+        # Inspecting the loaded libraries is slow, so it is done once.
+        if self._blas_controller is None:
+            self._blas_controller = ThreadpoolController()
+        return self._blas_controller
@@ -4,5 +4,6 @@ from .events import (
     MicroClusterSplitEvent,
     MicroClusterMergeEvent,
     MicroClusterCreationEvent,
+    MicroClusterRemovalEvent,
     ClusterUpdateEvent,
 )
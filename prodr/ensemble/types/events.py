@@ -1,19 +1,22 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
+    import numpy as np
+
     from prodr.ensemble.components import Node, MicroCluster
 
 
 @dataclass
 class InsertionEvent:
     """
-    Event representing the insertion of a data point into a leaf node.
+    Event representing the insertion of data points into a leaf node. A batch
+    yields one event per leaf it reaches, with the ids that leaf received.
     """
 
-    data_index: int
+    data_indices: np.ndarray
     node: Node
 
 
@@ -21,11 +24,15 @@ class InsertionEvent:
 class NodeSplitEvent:
     """
     Event representing the split of a parent node into two child nodes.
+    `left_indices` and `right_indices` are the data points the children received
+    at the split; a child split again in the same round no longer holds them.
     """
 
     parent_node: Node
     left_child: Node
     right_child: Node
+    left_indices: np.ndarray
+    right_indices: np.ndarray
 
 
 @dataclass
@@ -58,12 +65,25 @@ class MicroClusterCreationEvent:
     created_micro_cluster: MicroCluster
 
 
+@dataclass
+class MicroClusterRemovalEvent:
+    """
+    Event representing the removal of a micro-cluster whose data points have all expired.
+    """
+
+    removed_micro_cluster: MicroCluster
+
+
 @dataclass
 class ClusterUpdateEvent:
     """
     Event representing updates to clusters, including splits, merges, and creations.
+    `pending_splits` is the number of overflowing leaves deferred by the split
+    budget.
     """
 
     split_events: list[MicroClusterSplitEvent]
     merge_events: list[MicroClusterMergeEvent]
     creation_events: list[MicroClusterCreationEvent]
+    removal_events: list[MicroClusterRemovalEvent] = field(default_factory=list)
+    pending_splits: int = 0
@@ -1,13 +1,27 @@
 from .cluster import (
-    generate_cooccurr_mtx,
-    generate_cooccurr_acc_mtx,
-    count_cooccurrence,
+    count_thresholded_pairs,
+    count_leaf_neighbors,
     generate_micro_clusters,
     split_micro_cluster,
+    split_micro_cluster_locally,
     merge_micro_clusters,
+    label_components,
+)
+from .tree import (
+    compute_offset,
+    generate_hyperplane,
+    generate_normal,
+    project,
+    split_node,
+    stack_normals,
+    traverse_to_leaf,
+    traverse_to_leaf_ids,
+    gather_leaf_candidates,
+    pair_distances,
+    select_top_k,
 )
-from .tree import generate_hyperplane, generate_normal, split_node, traverse_to_leaf
 from .handlers import (
     update_micro_clusters_with_new_data,
     count_mcs_new_data_cooccurrence,
+    collect_split_decrements,
 )
@@ -1,8 +1,7 @@
 from .cooccurrence_count import (
-    generate_cooccurr_mtx,
-    generate_cooccurr_acc_mtx,
-    count_cooccurrence,
+    count_thresholded_pairs,
+    count_leaf_neighbors,
 )
-from .cluster_merging import merge_micro_clusters
-from .cluster_split import split_micro_cluster
+from .cluster_merging import merge_micro_clusters, label_components
+from .cluster_split import split_micro_cluster, split_micro_cluster_locally
 from .cluster_generation import generate_micro_clusters
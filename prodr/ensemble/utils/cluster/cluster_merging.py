@@ -1,27 +1,76 @@
-import scipy.sparse as sp
+import numpy as np
+
+from numba import njit
 
 from prodr.ensemble.components import MicroCluster
 
 
-def merge_micro_clusters(
-    micro_clusters: list[MicroCluster],
-) -> tuple[MicroCluster, MicroCluster]:
+def merge_micro_clusters(micro_clusters: list[MicroCluster]) -> MicroCluster:
+    """
+    Merge micro-clusters into the largest of them, in place. The co-occurrences
+    live in the shared graph, so merging only moves the members of the smaller
+    ones and its cost does not grow with the size of the largest.
+
+    Args:
+        micro_clusters (list[MicroCluster]): The micro-clusters to merge. Ties in
+            size go to the first one.
+
+    Returns:
+        MicroCluster: The largest micro-cluster, now holding every member.
+    """
     micro_clusters = sorted(micro_clusters, key=lambda mc: mc.size, reverse=True)
 
-    head_cluster = micro_clusters[0]
+    return micro_clusters[0].merge_micro_clusters(micro_clusters[1:])
 
-    for mc in micro_clusters[1:]:
-        head_cluster.indices += mc.indices
 
-    matrices = [mc.cooccurrence_count for mc in micro_clusters]
+def label_components(
+    n_nodes: int, rows: np.ndarray, cols: np.ndarray
+) -> tuple[int, np.ndarray]:
+    """
+    Connected components of a graph given by its edges, found with a
+    disjoint-set forest so the cost is linear in the number of edges.
 
-    head_cluster.cooccurrence_count = sp.block_diag(matrices, format="csr")  # type: ignore
+    Args:
+        n_nodes (int): Number of nodes.
+        rows (np.ndarray): First node of every edge.
+        cols (np.ndarray): Second node of every edge.
 
-    return (
-        MicroCluster(
-            indices=head_cluster.indices,
-            cooccurrence_count=head_cluster.cooccurrence_count,
-            head=head_cluster.head,
-        ),
-        head_cluster,
+    Returns:
+        tuple[int, np.ndarray]: Number of components and the component of every
+        node, numbered in the order of their lowest node.
+    """
+    roots = _union_find(
+        n_nodes,
+        np.asarray(rows, dtype=np.int64),
+        np.asarray(cols, dtype=np.int64),
     )
+    _, labels = np.unique(roots, return_inverse=True)
+
+    return int(labels.max()) + 1 if n_nodes else 0, labels
+
+
+@njit(nogil=True)
+def _find_root(parent: np.ndarray, node: int) -> int:
+    while parent[node] != node:
+        # Path halving keeps the trees flat.
+        parent[node] = parent[parent[node]]
+        node = parent[node]
+    return node
+
+
+@njit(nogil=True)
+def _union_find(n_nodes: int, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    parent = np.arange(n_nodes)
+    for e in range(rows.shape[0]):
+        a = _find_root(parent, rows[e])
+        b = _find_root(parent, cols[e])
+        # The lowest node of a component is its root.
+        if a < b:
+            parent[b] = a
+        elif b < a:
+            parent[a] = b
+
+    for node in range(n_nodes):
+        parent[node] = _find_root(parent, node)
+
+    return parent
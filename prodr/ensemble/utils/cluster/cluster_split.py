@@ -1,6 +1,7 @@
+import numpy as np
 from scipy.sparse.csgraph import connected_components
 
-from prodr.ensemble.components import MicroCluster
+from prodr.ensemble.components import CooccurrenceGraph, MicroCluster
 from .cluster_generation import generate_micro_clusters
 
 
@@ -14,9 +15,6 @@ def split_micro_cluster(
     # Create a binary adjacency matrix based on the threshold
     adjacency_matrix = cooccurr_mtx >= threshold
 
-    filtered_inner_structure = cooccurr_mtx.multiply(adjacency_matrix)
-    filtered_inner_structure.eliminate_zeros()
-
     # Find connected components in the graph represented by the adjacency matrix
     n_components, labels = connected_components(
         adjacency_matrix, directed=False, return_labels=True
@@ -28,9 +26,132 @@ def split_micro_cluster(
         generate_micro_clusters(
             n_components,
             labels,
-            filtered_inner_structure,
             members,
+            micro_cluster.graph,
             head_global_idx,
         ),
         labels[micro_cluster.get_local_idx(head_global_idx)],
     )
+
+
+def split_micro_cluster_locally(
+    micro_cluster: MicroCluster,
+    broken_rows: np.ndarray,
+    broken_cols: np.ndarray,
+    threshold: int,
+    max_endpoint_ratio: float = 1 / 64,
+) -> tuple[list[MicroCluster], int]:
+    """
+    Split a micro-cluster after some of its edges were dropped, searching only
+    around the endpoints of those edges.
+
+    A micro-cluster is connected before its edges are dropped, so every piece
+    it falls into holds an endpoint of a dropped edge. Every endpoint not yet
+    known to be connected to an anchor endpoint is searched against it from
+    both sides at once, always growing the smaller side: the search stops as
+    soon as the sides meet, or when one side runs out of points, which is then
+    a piece of its own and is carved out. The search thus stays around the
+    dropped edges and the pieces carved out instead of covering the whole
+    micro-cluster.
+
+    When the dropped edges touch many of its points, searching from each of
+    them costs more than one pass over the micro-cluster, which is then split
+    with `split_micro_cluster`.
+
+    Args:
+        micro_cluster (MicroCluster): The micro-cluster, whose dropped edges have
+            already been removed from its graph.
+        broken_rows (np.ndarray): First endpoint of every dropped edge.
+        broken_cols (np.ndarray): Second endpoint of every dropped edge.
+        threshold (int): Minimum co-occurrence count of an edge.
+        max_endpoint_ratio (float): Share of its points, beyond a few, the
+            endpoints may make up for the micro-cluster to be searched locally.
+
+    Returns:
+        tuple[list[MicroCluster], int]: The micro-clusters it splits into and the
+        index of the one holding its head. A micro-cluster that is still
+        connected is returned alone.
+    """
+    graph = micro_cluster.graph
+    endpoints = np.unique(np.concatenate([broken_rows, broken_cols])).tolist()
+    if len(endpoints) > 8 + max_endpoint_ratio * micro_cluster.size:
+        return split_micro_cluster(micro_cluster, threshold)
+
+    # Every endpoint is searched against an anchor, which is replaced whenever
+    # its own piece is carved out.
+    pieces: list[set[int]] = []
+    carved: set[int] = set()
+    anchor = endpoints[0]
+    connected = {anchor}
+    for endpoint in endpoints[1:]:
+        if endpoint in connected or endpoint in carved:
+            continue
+
+        reached, exhausted = _bidirectional_search(graph, anchor, endpoint, connected)
+        if exhausted is None:
+            connected |= reached[0] | reached[1]
+            continue
+
+        pieces.append(reached[exhausted])
+        carved |= reached[exhausted]
+        if exhausted == 0:
+            anchor, connected = endpoint, reached[1]
+        else:
+            connected |= reached[0]
+
+    if not pieces:
+        return [micro_cluster], 0
+
+    groups = [sorted(piece, key=micro_cluster.get_local_idx) for piece in pieces] + [
+        [i for i in micro_cluster.indices if i not in carved]
+    ]
+
+    head = micro_cluster.head
+    inherit_label = next(label for label, group in enumerate(groups) if head in group)
+    new_mcs = [
+        MicroCluster(
+            indices=group,
+            head=head if label == inherit_label else group[0],
+            graph=graph,
+        )
+        for label, group in enumerate(groups)
+    ]
+
+    return new_mcs, inherit_label
+
+
+def _bidirectional_search(
+    graph: CooccurrenceGraph, source: int, target: int, source_component: set[int]
+) -> tuple[tuple[set[int], set[int]], int | None]:
+    """
+    Grow the points reachable from `source` and from `target` level by level,
+    expanding the smaller side first. The sides also meet when `target`
+    reaches `source_component`, the points already known to be connected to
+    `source`.
+    Returns:
+        tuple[tuple[set[int], set[int]], int | None]: The points reached from
+        either side and the side that ran out of points, None when they met.
+    """
+    reached = ({source}, {target})
+    frontiers = [np.array([source]), np.array([target])]
+    while True:
+        for side in (0, 1):
+            if frontiers[side].shape[0] == 0:
+                return reached, side
+
+        side = 0 if len(reached[0]) <= len(reached[1]) else 1
+        new = [
+            node
+            for node in graph.neighbors(frontiers[side]).tolist()
+            if node not in reached[side]
+        ]
+        if side == 0:
+            met = any(node in reached[1] for node in new)
+        else:
+            met = any(node in reached[0] or node in source_component for node in new)
+        if met:
+            reached[side].update(new)
+            return reached, None
+
+        reached[side].update(new)
+        frontiers[side] = np.array(new, dtype=np.int64)
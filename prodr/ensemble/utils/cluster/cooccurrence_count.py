@@ -1,75 +1,277 @@
-from collections import Counter
-
 import numpy as np
-import scipy.sparse as sp
+
+from numba import njit, prange
 
 from prodr.ensemble.components import Node
 
 
-def generate_cooccurr_mtx(
-    cooccurr_list: list[list[int]], n_samples: int
-) -> sp.csr_array:
+def count_thresholded_pairs(
+    leaf_nodes: list[list[Node]], n_samples: int, offset: int, threshold: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Generate cooccurrence count matrix from a single tree.
+    Find every pair of data points sharing a leaf in at least `threshold` trees,
+    without materializing the pairs of every leaf.
+
+    Points are described by their leaf signature, the position of their leaf in
+    every tree. A pair sharing at least `threshold` of the `n_trees` leaves
+    shares one of the first `n_trees - threshold + 1`, so only the co-members
+    of those leaves are candidates. A candidate is kept in the first of those
+    trees where the pair meets, and its signatures are compared until more
+    than `n_trees - threshold` trees differ. The points are scanned in parallel
+    twice: once to count the pairs of every point, once to write them.
+
     Args:
-        cooccurr_list: List of cooccurr_cnt lists from a single tree.
-            indexed by [node_idx][data_point_indices].
-            cooccurr_list[node_idx] means the list of data point indices
-            that fall into the same node.
-        n_samples: Total number of samples.
+        leaf_nodes (list[list[Node]]): Leaf nodes of every tree.
+        n_samples (int): Number of data points, with ids from `offset`.
+        offset (int): Id of the first data point.
+        threshold (int): Minimum number of shared leaves.
+
     Returns:
-        Cooccurrence matrix of shape (n_samples, n_samples).
+        tuple[np.ndarray, np.ndarray, np.ndarray]: For every pair, the lower id,
+        the higher id and the number of trees in which they share a leaf.
     """
-    row_chunks = []
-    col_chunks = []
+    n_trees = len(leaf_nodes)
+    signatures = np.full((n_samples, n_trees), -1, dtype=np.int64)
+    members, sizes = [], []
+    for t, tree_leaf_nodes in enumerate(leaf_nodes):
+        for position, node in enumerate(tree_leaf_nodes):
+            local_ids = np.asarray(node.indices, dtype=np.int64) - offset
+            signatures[local_ids, t] = position
+            members.append(local_ids)
+            sizes.append(local_ids.shape[0])
+
+    leaf_ptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=leaf_ptr[1:])
+    tree_offsets = np.zeros(n_trees + 1, dtype=np.int64)
+    np.cumsum(
+        [len(tree_leaf_nodes) for tree_leaf_nodes in leaf_nodes], out=tree_offsets[1:]
+    )
+    members_arr = np.concatenate(members) if members else np.empty(0, dtype=np.int64)
 
-    for cooccurr_indices in cooccurr_list:
-        indices = np.asarray(cooccurr_indices, dtype=np.int64)
-        m = indices.size
-        if m <= 1:
+    n_pairs = _count_pairs(signatures, members_arr, leaf_ptr, tree_offsets, threshold)
+    pair_ptr = np.zeros(n_samples + 1, dtype=np.int64)
+    np.cumsum(n_pairs, out=pair_ptr[1:])
+    rows, cols, counts = _write_pairs(
+        signatures, members_arr, leaf_ptr, tree_offsets, threshold, pair_ptr
+    )
+
+    return rows + offset, cols + offset, counts
+
+
+@njit(nogil=True)
+def _scan_pairs(
+    i: int,
+    signatures: np.ndarray,
+    members: np.ndarray,
+    leaf_ptr: np.ndarray,
+    tree_offsets: np.ndarray,
+    threshold: int,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    counts: np.ndarray,
+    start: int,
+) -> int:
+    """
+    Scan the partners `j > i` of point `i`, writing the pairs from `start` when
+    `start` is not negative. Returns the number of pairs.
+    """
+    n_trees = signatures.shape[1]
+    max_misses = n_trees - threshold
+    n_found = 0
+    for k in range(min(max_misses + 1, n_trees)):
+        if signatures[i, k] < 0:
             continue
+        leaf = tree_offsets[k] + signatures[i, k]
+        for m in range(leaf_ptr[leaf], leaf_ptr[leaf + 1]):
+            j = members[m]
+            if j <= i:
+                continue
 
-        rr, cc = np.triu_indices(m, k=1)
-        row_chunks.append(indices[rr])
-        col_chunks.append(indices[cc])
+            # The pair is counted in the first tree where it meets.
+            met_before = False
+            for t in range(k):
+                if signatures[i, t] == signatures[j, t]:
+                    met_before = True
+                    break
+            if met_before:
+                continue
 
-    if not row_chunks:
-        return sp.csr_array((n_samples, n_samples), dtype=np.int32)
+            misses = k
+            for t in range(k + 1, n_trees):
+                if signatures[i, t] != signatures[j, t]:
+                    misses += 1
+                    if misses > max_misses:
+                        break
+            if misses > max_misses:
+                continue
 
-    rows = np.concatenate(row_chunks)
-    cols = np.concatenate(col_chunks)
-    data = np.ones(rows.size, dtype=np.int32)
-    C = sp.coo_matrix(
-        (data, (rows, cols)), shape=(n_samples, n_samples), dtype=np.int32
-    ).tocsr()
-    C.sum_duplicates()
-    C.eliminate_zeros()
+            if start >= 0:
+                rows[start + n_found] = i
+                cols[start + n_found] = j
+                counts[start + n_found] = n_trees - misses
+            n_found += 1
 
-    return C + C.T
+    return n_found
 
 
-def generate_cooccurr_acc_mtx(
-    cooccurr_cnt_list: list[list[list[int]]], n_samples: int
-) -> sp.csr_array:
+@njit(parallel=True)
+def _count_pairs(
+    signatures: np.ndarray,
+    members: np.ndarray,
+    leaf_ptr: np.ndarray,
+    tree_offsets: np.ndarray,
+    threshold: int,
+) -> np.ndarray:
+    n_samples = signatures.shape[0]
+    n_pairs = np.zeros(n_samples, dtype=np.int64)
+    empty = np.empty(0, dtype=np.int64)
+    empty_counts = np.empty(0, dtype=np.int32)
+    for i in prange(n_samples):  # pylint: disable=not-an-iterable
+        n_pairs[i] = _scan_pairs(
+            i,
+            signatures,
+            members,
+            leaf_ptr,
+            tree_offsets,
+            threshold,
+            empty,
+            empty,
+            empty_counts,
+            -1,
+        )
+    return n_pairs
+
+
+@njit(parallel=True)
+def _write_pairs(
+    signatures: np.ndarray,
+    members: np.ndarray,
+    leaf_ptr: np.ndarray,
+    tree_offsets: np.ndarray,
+    threshold: int,
+    pair_ptr: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    n_samples = signatures.shape[0]
+    rows = np.empty(pair_ptr[-1], dtype=np.int64)
+    cols = np.empty(pair_ptr[-1], dtype=np.int64)
+    counts = np.empty(pair_ptr[-1], dtype=np.int32)
+    for i in prange(n_samples):  # pylint: disable=not-an-iterable
+        _scan_pairs(
+            i,
+            signatures,
+            members,
+            leaf_ptr,
+            tree_offsets,
+            threshold,
+            rows,
+            cols,
+            counts,
+            pair_ptr[i],
+        )
+    return rows, cols, counts
+
+
+def count_leaf_neighbors(
+    leaf_ids: np.ndarray,
+    leaf_tables: list[list[Node | None]],
+    point_ids: np.ndarray,
+    threshold: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Generate accumulated cooccurrence count matrix from multiple trees.
+    Find, for every point of a batch, the data points sharing its leaf in at
+    least `threshold` trees.
+
+    The members of the leaves the batch fell into are gathered once per
+    distinct leaf. A numba kernel then merges the `n_trees` leaves of every
+    point in parallel: their members are sorted and every run at least
+    `threshold` long is a neighbor. A neighbor shares one of the first
+    `n_trees - threshold + 1` leaves, which bounds the output of every point.
+
     Args:
-        cooccurr_cnt_list: List of cooccurr_cnt lists from multiple trees.
-            indexed by [tree_idx][node_idx][data_point_indices].
-        n_samples: Total number of samples.
+        leaf_ids (np.ndarray): Leaf id of every point in every tree, shape
+            (n_points, n_trees).
+        leaf_tables (list[list[Node | None]]): Mapping from leaf ids to nodes per tree.
+        point_ids (np.ndarray): Id of every point, excluded from its own neighbors.
+        threshold (int): Minimum number of shared leaves.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: For every (point, neighbor)
+        pair, sorted by point then neighbor: the id of the point, the id of the
+        neighbor and the number of trees in which they share a leaf.
     """
-    C_total = sp.csr_array((n_samples, n_samples), dtype=np.int32)
+    n_points, n_trees = leaf_ids.shape
+    positions = np.empty((n_points, n_trees), dtype=np.int64)
+    members, sizes = [], []
+    for t, leaf_table in enumerate(leaf_tables):
+        unique_leaves, inverse = np.unique(leaf_ids[:, t], return_inverse=True)
+        positions[:, t] = inverse.reshape(-1) + len(sizes)
+        for leaf_id in unique_leaves.tolist():
+            node: Node = leaf_table[leaf_id]  # type: ignore
+            members.append(np.asarray(node.indices, dtype=np.int64))
+            sizes.append(members[-1].shape[0])
+
+    leaf_ptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=leaf_ptr[1:])
+    members_arr = np.concatenate(members) if members else np.empty(0, dtype=np.int64)
+
+    n_candidate_trees = max(0, min(n_trees - threshold + 1, n_trees))
+    leaf_sizes = np.diff(leaf_ptr)[positions[:, :n_candidate_trees]]
+    pair_ptr = np.zeros(n_points + 1, dtype=np.int64)
+    np.cumsum(leaf_sizes.sum(axis=1), out=pair_ptr[1:])
+
+    point_ids = np.asarray(point_ids, dtype=np.int64)
+    neighbors, counts, n_found = _merge_leaves(
+        positions, members_arr, leaf_ptr, point_ids, threshold, pair_ptr
+    )
+    keep = np.arange(pair_ptr[-1]) - np.repeat(pair_ptr[:-1], np.diff(pair_ptr))
+    keep = keep < np.repeat(n_found, np.diff(pair_ptr))
 
-    for cooccurr_list in cooccurr_cnt_list:
-        C_tree = generate_cooccurr_mtx(cooccurr_list, n_samples)
-        C_total += C_tree
+    return (
+        np.repeat(point_ids, n_found),
+        neighbors[keep],
+        counts[keep],
+    )
 
-    return C_total
 
+@njit(parallel=True)
+def _merge_leaves(
+    positions: np.ndarray,
+    members: np.ndarray,
+    leaf_ptr: np.ndarray,
+    point_ids: np.ndarray,
+    threshold: int,
+    pair_ptr: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    n_points, n_trees = positions.shape
+    neighbors = np.empty(pair_ptr[-1], dtype=np.int64)
+    counts = np.empty(pair_ptr[-1], dtype=np.int32)
+    n_found = np.zeros(n_points, dtype=np.int64)
+    for i in prange(n_points):  # pylint: disable=not-an-iterable
+        n_members = 0
+        for t in range(n_trees):
+            leaf = positions[i, t]
+            n_members += leaf_ptr[leaf + 1] - leaf_ptr[leaf]
+        merged = np.empty(n_members, dtype=np.int64)
+        n_members = 0
+        for t in range(n_trees):
+            leaf = positions[i, t]
+            size = leaf_ptr[leaf + 1] - leaf_ptr[leaf]
+            merged[n_members : n_members + size] = members[
+                leaf_ptr[leaf] : leaf_ptr[leaf + 1]
+            ]
+            n_members += size
+        merged.sort()
 
-def count_cooccurrence(Nodes: list[Node], threshold: int) -> dict[int, int]:
-    counter = Counter()
-    for node in Nodes:
-        counter.update(node.indices)
+        start = pair_ptr[i]
+        run_start = 0
+        for m in range(1, n_members + 1):
+            if m < n_members and merged[m] == merged[run_start]:
+                continue
+            count = m - run_start
+            if count >= threshold and merged[run_start] != point_ids[i]:
+                neighbors[start + n_found[i]] = merged[run_start]
+                counts[start + n_found[i]] = count
+                n_found[i] += 1
+            run_start = m
 
-    return {idx: count for idx, count in counter.items() if count >= threshold}
+    return neighbors, counts, n_found
@@ -2,3 +2,4 @@ from .insertion_handler import (
     update_micro_clusters_with_new_data,
     count_mcs_new_data_cooccurrence,
 )
+from .split_handler import collect_split_decrements
@@ -1,156 +1,143 @@
-import scipy.sparse as sp
+import numpy as np
 
-
-from prodr.ensemble.components import MicroCluster, Node
+from prodr.ensemble.components import CooccurrenceGraph, MicroCluster, Node
 from prodr.ensemble.types import MicroClusterCreationEvent, MicroClusterMergeEvent
-from prodr.ensemble.utils import count_cooccurrence, merge_micro_clusters
+from prodr.ensemble.utils import (
+    count_leaf_neighbors,
+    label_components,
+    merge_micro_clusters,
+)
 
 
 def count_mcs_new_data_cooccurrence(
-    micro_clusters: list[MicroCluster],
     new_data_idx_range: tuple[int, int],
-    forest_id2node: list[list[Node]],
+    forest_leaf_ids: np.ndarray,
+    leaf_tables: list[list[Node | None]],
     threshold: int,
-    id_to_mc: dict[int, MicroCluster],
-) -> tuple[sp.csr_array, dict[int, list[tuple[int, int]]]]:
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Count cooccurrence between existing micro-clusters and new data points.
+    Count cooccurrence between new data points and the existing data points.
 
     Args:
-        micro_clusters (list[MicroCluster]): List of existing micro-clusters.
-        range(start_idx, end_idx + 1) (list[int]): List of new data point indices.
+        new_data_idx_range (tuple[int, int]): First and last id of the new data points.
+        forest_leaf_ids (np.ndarray): Leaf id of every new data point in every tree,
+            shape (n_new_data_points, n_trees).
+        leaf_tables (list[list[Node | None]]): Mapping from leaf ids to nodes per tree.
+        threshold (int): Minimum number of shared leaves of an edge.
 
     Returns:
-        sp.csr_array: Cooccurrence count matrix of shape
-            (n_micro_clusters, n_new_data_points).
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The edges of the new data
+            points (new data point id, neighbor id, count), every pair of new data
+            points appearing once.
     """
     start_idx, end_idx = new_data_idx_range
-    n_mcs = len(micro_clusters)
-    n_new = end_idx - start_idx + 1
-    n_total = n_mcs + n_new
-
-    neighbors_of_new: dict[int, list[tuple[int, int]]] = {
-        i: [] for i in range(start_idx, end_idx + 1)
-    }
-    mc2mcidx = {mc: idx for idx, mc in enumerate(micro_clusters)}
-
-    rows = []
-    cols = []
-    counts = []
-
-    for new_idx in range(start_idx, end_idx + 1):
-        assigned_nodes = [tree_id2node[new_idx] for tree_id2node in forest_id2node]
-
-        neighbors = count_cooccurrence(assigned_nodes, threshold)
-        neighbors.pop(new_idx, None)
 
-        i = n_mcs + (new_idx - start_idx)
-
-        for neighbor_idx, count in neighbors.items():
-            if neighbor_idx >= start_idx:
-                j = n_mcs + (neighbor_idx - start_idx)
-
-            else:
-                mc = id_to_mc[neighbor_idx]
-                j = mc2mcidx[mc]
-                neighbors_of_new[new_idx].append((neighbor_idx, count))
-
-            rows.append(i)
-            cols.append(j)
-            counts.append(count)
-
-    coocc = sp.coo_array(
-        (counts, (rows, cols)), shape=(n_total, n_total), dtype=int
-    ).tocsr()
-    coocc = coocc + coocc.T
+    new_ids, neighbor_ids, counts = count_leaf_neighbors(
+        forest_leaf_ids, leaf_tables, np.arange(start_idx, end_idx + 1), threshold
+    )
+    # Pairs of new data points are recorded once.
+    keep = (neighbor_ids < start_idx) | (neighbor_ids > new_ids)
 
-    return coocc, neighbors_of_new
+    return new_ids[keep], neighbor_ids[keep], counts[keep]
 
 
 def update_micro_clusters_with_new_data(
-    coocurrence_matrix: sp.csr_array,
-    micro_clusters: list[MicroCluster],
-    start_idx: int,
-    neighbors_of_new_data: dict[int, list[tuple[int, int]]],
+    new_data_idx_range: tuple[int, int],
+    new_ids: np.ndarray,
+    neighbor_ids: np.ndarray,
+    id_to_mc: dict[int, MicroCluster],
+    graph: CooccurrenceGraph,
 ) -> tuple[
     list[MicroClusterMergeEvent],
     list[MicroClusterCreationEvent],
     list[MicroCluster],
     set[MicroCluster],
 ]:
+    """
+    Group new data points into micro-clusters along their edges.
+
+    The new data points and the micro-clusters they reach are the nodes of a
+    union-find built for the batch and united along its edges, so only the
+    micro-clusters touched by the batch are visited. Each group is merged in
+    place into its largest micro-cluster, and `id_to_mc` is updated only for
+    the data points that moved.
+
+    Args:
+        new_data_idx_range (tuple[int, int]): First and last id of the new data points.
+        new_ids (np.ndarray): New data point of every edge.
+        neighbor_ids (np.ndarray): Other data point of every edge.
+        id_to_mc (dict[int, MicroCluster]): Mapping from the existing data point ids
+            to their micro-clusters, updated in place.
+        graph (CooccurrenceGraph): Co-occurrence graph the micro-clusters view.
+
+    Returns:
+        tuple: The merge and creation events, the new micro-clusters and the
+        micro-clusters absorbed by a merge.
+    """
     mc_merge_events: list[MicroClusterMergeEvent] = []
     mc_creation_events: list[MicroClusterCreationEvent] = []
     created_mcs = []
     removed_mcs: set[MicroCluster] = set()
 
-    n_mcs = len(micro_clusters)
+    start_idx, end_idx = new_data_idx_range
+    n_new = end_idx - start_idx + 1
 
-    _, labels = sp.csgraph.connected_components(
-        coocurrence_matrix, directed=False, return_labels=True
+    # Nodes are the new data points followed by the micro-clusters they reach.
+    is_new = neighbor_ids >= start_idx
+    old_ids, old_inverse = np.unique(neighbor_ids[~is_new], return_inverse=True)
+    mc_nodes: dict[MicroCluster, int] = {}
+    old_nodes = np.array(
+        [
+            mc_nodes.setdefault(id_to_mc[i], n_new + len(mc_nodes))
+            for i in old_ids.tolist()
+        ],
+        dtype=np.int64,
     )
 
-    indices_by_label: dict[int, list[int]] = {}
-
-    for idx, label in enumerate(labels):
-        indices_by_label.setdefault(label, []).append(idx)
-
-    for label, indices in indices_by_label.items():
-        mcs_to_merge: list[MicroCluster] = []
-
-        new_data_global_ids = []
-        new_data_local_ids = []
-        cooccurr_cnts_to_update = []
-
-        for idx in indices:
-            if idx < n_mcs:
-                mc = micro_clusters[idx]
-                mcs_to_merge.append(mc)
-            else:
-                new_data_global_id = start_idx + (idx - n_mcs)
-                new_data_global_ids.append(new_data_global_id)
-                new_data_local_ids.append(idx)
-
-                cooccurr_cnts_to_update.extend(
-                    [
-                        (new_data_global_id, *neighbor_and_count)
-                        for neighbor_and_count in neighbors_of_new_data[
-                            new_data_global_id
-                        ]
-                    ]
-                )
-        if not new_data_global_ids:
-            continue
+    cols = np.empty(neighbor_ids.shape[0], dtype=np.int64)
+    cols[is_new] = neighbor_ids[is_new] - start_idx
+    cols[~is_new] = old_nodes[old_inverse]
+
+    _, labels = label_components(n_new + len(mc_nodes), new_ids - start_idx, cols)
 
-        new_mc_cooccurr_mtx = coocurrence_matrix[new_data_local_ids][
-            :, new_data_local_ids
-        ]
+    new_data_ids_by_label: dict[int, list[int]] = {}
+    for idx, label in enumerate(labels[:n_new].tolist()):
+        new_data_ids_by_label.setdefault(label, []).append(start_idx + idx)
+
+    mcs_by_label: dict[int, list[MicroCluster]] = {}
+    for mc, label in zip(mc_nodes, labels[n_new:].tolist()):
+        mcs_by_label.setdefault(label, []).append(mc)
+
+    for label, new_data_global_ids in new_data_ids_by_label.items():
+        mcs_to_merge = mcs_by_label.get(label, [])
 
         new_mc = MicroCluster(
             indices=new_data_global_ids,
-            cooccurrence_count=new_mc_cooccurr_mtx,
             head=new_data_global_ids[0],
+            graph=graph,
         )
 
         if mcs_to_merge:
-            merged_mc, head_mc = merge_micro_clusters(mcs_to_merge + [new_mc])
-            merged_mc.update_cooccurrence_count(
-                [update[0] for update in cooccurr_cnts_to_update],
-                [update[1] for update in cooccurr_cnts_to_update],
-                [update[2] for update in cooccurr_cnts_to_update],
-            )
+            merged_mcs = mcs_to_merge + [new_mc]
+            head_mc = merge_micro_clusters(merged_mcs)
             mc_merge_events.append(
                 MicroClusterMergeEvent(
-                    merged_micro_clusters=mcs_to_merge + [new_mc],
+                    merged_micro_clusters=merged_mcs,
                     head_micro_cluster=head_mc,
                 )
             )
-            removed_mcs.update(mcs_to_merge)
-            created_mcs.append(merged_mc)
+            for mc in merged_mcs:
+                if mc is not head_mc or mc is new_mc:
+                    id_to_mc.update(dict.fromkeys(mc.indices, head_mc))
+            removed_mcs.update(mc for mc in mcs_to_merge if mc is not head_mc)
+            if head_mc is new_mc:
+                created_mcs.append(new_mc)
 
         else:
             mc_creation_events.append(
                 MicroClusterCreationEvent(created_micro_cluster=new_mc)
             )
+            id_to_mc.update(dict.fromkeys(new_mc.indices, new_mc))
             created_mcs.append(new_mc)
 
     return mc_merge_events, mc_creation_events, created_mcs, removed_mcs
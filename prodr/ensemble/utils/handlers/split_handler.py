@@ -0,0 +1,76 @@
+import numpy as np
+
+from prodr.ensemble.components import MicroCluster
+from prodr.ensemble.types import NodeSplitEvent
+
+
+def collect_split_decrements(
+    split_events: list[list[NodeSplitEvent]],
+    start_idx: int,
+    id_to_mc: dict[int, MicroCluster],
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Collect the pairs of data points separated by node splits whose
+    co-occurrence count has to be decremented.
+
+    A split separates every point of its left child from every point of its
+    right child, but only pairs within the same micro-cluster can hold an edge.
+    The pairs of every event of every tree are generated at once: points are
+    grouped by (event, micro-cluster) and each left point is paired with the
+    right points of its group.
+
+    Args:
+        split_events (list[list[NodeSplitEvent]]): Split events per tree.
+        start_idx (int): Id of the first data point of the current batch. Points
+            from the batch have no co-occurrences yet and are skipped.
+        id_to_mc (dict[int, MicroCluster]): Mapping from data point ids to their
+            micro-clusters.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Endpoints of every separated pair, one
+        entry per split separating it.
+    """
+    left_parts, right_parts, left_events, right_events = [], [], [], []
+    n_events = 0
+    for tree_events in split_events:
+        for event in tree_events:
+            left_ids = event.left_indices[event.left_indices < start_idx]
+            right_ids = event.right_indices[event.right_indices < start_idx]
+            if left_ids.shape[0] > 0 and right_ids.shape[0] > 0:
+                left_parts.append(left_ids)
+                right_parts.append(right_ids)
+                left_events.append(np.full(left_ids.shape[0], n_events))
+                right_events.append(np.full(right_ids.shape[0], n_events))
+                n_events += 1
+
+    if n_events == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    left = np.concatenate(left_parts).astype(np.int64, copy=False)
+    right = np.concatenate(right_parts).astype(np.int64, copy=False)
+
+    # Label every point with its micro-cluster, looking each id up once.
+    unique_ids, inverse = np.unique(np.concatenate([left, right]), return_inverse=True)
+    mc_labels: dict[MicroCluster, int] = {}
+    labels = np.array(
+        [
+            mc_labels.setdefault(id_to_mc[i], len(mc_labels))
+            for i in unique_ids.tolist()
+        ],
+        dtype=np.int64,
+    )[inverse]
+    n_labels = len(mc_labels)
+
+    left_groups = np.concatenate(left_events) * n_labels + labels[: left.shape[0]]
+    right_groups = np.concatenate(right_events) * n_labels + labels[left.shape[0] :]
+
+    order = np.argsort(right_groups, kind="stable")
+    right, right_groups = right[order], right_groups[order]
+
+    starts = np.searchsorted(right_groups, left_groups, side="left")
+    lengths = np.searchsorted(right_groups, left_groups, side="right") - starts
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+    return np.repeat(left, lengths), right[positions]
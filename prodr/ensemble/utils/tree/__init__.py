@@ -1,2 +1,10 @@
-from .node_splitting import generate_hyperplane, generate_normal, split_node
-from .tree_traversal import traverse_to_leaf
+from .node_splitting import (
+    compute_offset,
+    generate_hyperplane,
+    generate_normal,
+    project,
+    split_node,
+    stack_normals,
+)
+from .tree_traversal import traverse_to_leaf, traverse_to_leaf_ids
+from .neighbors import gather_leaf_candidates, pair_distances, select_top_k
@@ -0,0 +1,110 @@
+from typing import Any
+
+import numpy as np
+import scipy.sparse as sp
+
+from prodr.ensemble.components import Node
+
+
+def gather_leaf_candidates(
+    leaf_ids: np.ndarray, leaf_tables: list[list[Node | None]]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Collect the union of the members of the leaves a batch of queries fell into.
+
+    Args:
+        leaf_ids (np.ndarray): Leaf id of every query in every tree, shape
+            (n_queries, n_trees).
+        leaf_tables (list[list[Node | None]]): Mapping from leaf ids to nodes per tree.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: For every distinct (query,
+        candidate) pair, sorted by query then candidate: the query index, the id
+        of the candidate and the number of trees in which they share a leaf.
+    """
+    n_queries = leaf_ids.shape[0]
+    if n_queries == 0 or leaf_ids.shape[1] == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    query_parts, member_parts = [], []
+    for t, leaf_table in enumerate(leaf_tables):
+        nodes: list[Node] = [leaf_table[i] for i in leaf_ids[:, t].tolist()]  # type: ignore
+        sizes = [node.size for node in nodes]
+        query_parts.append(np.repeat(np.arange(n_queries), sizes))
+        member_parts.append(np.concatenate([node.indices for node in nodes]))
+
+    queries = np.concatenate(query_parts)
+    members = np.concatenate(member_parts).astype(np.int64, copy=False)
+    order = np.lexsort((members, queries))
+    queries, members = queries[order], members[order]
+
+    is_first = np.ones(queries.shape[0], dtype=bool)
+    is_first[1:] = (queries[1:] != queries[:-1]) | (members[1:] != members[:-1])
+    starts = np.flatnonzero(is_first)
+    counts = np.diff(np.append(starts, queries.shape[0]))
+
+    return queries[starts], members[starts], counts
+
+
+def pair_distances(
+    A: Any, B: Any, a_idx: np.ndarray, b_idx: np.ndarray, chunk_size: int = 1 << 22
+) -> np.ndarray:
+    """
+    Euclidean distances between the rows `A[a_idx[i]]` and `B[b_idx[i]]`.
+
+    Args:
+        A (np.ndarray | sp.csr_array): First set of points.
+        B (np.ndarray | sp.csr_array): Second set of points.
+        a_idx (np.ndarray): Row of `A` of every pair.
+        b_idx (np.ndarray): Row of `B` of every pair.
+        chunk_size (int): Number of coordinates of the pair differences
+            materialized at once.
+
+    Returns:
+        np.ndarray: The distance of every pair.
+    """
+    n_pairs = a_idx.shape[0]
+    distances = np.empty(n_pairs, dtype=np.float64)
+    step = max(1, chunk_size // max(A.shape[1], 1))
+    for start in range(0, n_pairs, step):
+        end = min(start + step, n_pairs)
+        diff = A[a_idx[start:end]] - B[b_idx[start:end]]
+        if sp.issparse(diff):
+            distances[start:end] = np.asarray(diff.multiply(diff).sum(axis=1)).ravel()
+        else:
+            distances[start:end] = np.einsum("ij,ij->i", diff, diff)
+
+    return np.sqrt(distances)
+
+
+def select_top_k(
+    queries: np.ndarray,
+    candidates: np.ndarray,
+    scores: np.ndarray,
+    n_queries: int,
+    k: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Keep the `k` candidates with the lowest score of every query, breaking ties
+    by candidate id.
+
+    Args:
+        queries (np.ndarray): Query index of every (query, candidate) pair.
+        candidates (np.ndarray): Candidate id of every pair.
+        scores (np.ndarray): Score of every pair; lower is better.
+        n_queries (int): Number of queries.
+        k (int): Number of candidates to keep per query.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: For every kept pair, its query
+        index, its rank among the candidates of the query and its position in the
+        input arrays.
+    """
+    order = np.lexsort((candidates, scores, queries))
+    sorted_queries = queries[order]
+    starts = np.searchsorted(sorted_queries, np.arange(n_queries))
+    ranks = np.arange(order.shape[0]) - starts[sorted_queries]
+    keep = ranks < k
+
+    return sorted_queries[keep], ranks[keep], order[keep]
@@ -1,18 +1,19 @@
-from typing import Optional
+from typing import Literal, Optional
 import numpy as np
+import scipy.sparse as sp
 
 from prodr.ensemble.components import Hyperplane, Node
 
 
 def split_node(
-    node: Node, left: list[int], right: list[int], hyperplane: Hyperplane
+    node: Node, left: np.ndarray, right: np.ndarray, hyperplane: Hyperplane
 ) -> tuple[Node, Node]:
     """
     Split a node into two child nodes based on the provided hyperplane and data indices.
     Args:
         node (Node): The node to be split.
-        left (list[int]): Indices of data points for the left child.
-        right (list[int]): Indices of data points for the right child.
+        left (np.ndarray): Indices of data points for the left child.
+        right (np.ndarray): Indices of data points for the right child.
         hyperplane (Hyperplane): The hyperplane used for splitting.
     """
     left_child = Node(
@@ -32,47 +33,153 @@ def split_node(
     node.right = right_child
     node.is_leaf = False
     node.hyperplane = hyperplane
+    # Membership is tracked by the leaves only.
+    node.indices = np.empty(0, dtype=np.int64)
+    node._buffer = None
 
     return left_child, right_child
 
 
 def generate_hyperplane(
-    data: np.ndarray,
+    data: np.ndarray | None = None,
     normal_vector: Optional[np.ndarray] = None,
     rng: np.random.Generator | None = None,
+    dtype: np.dtype | type = np.float64,
+    projections: Optional[np.ndarray] = None,
+    b_strategy: str = "default",
+    offset: Optional[float] = None,
+    family: Literal["gaussian", "sparse"] = "gaussian",
 ) -> Hyperplane:
     """
     Generate a hyperplane that approximately bisects the given dataset.
     Args:
-        data (np.ndarray): The input dataset, shape (n_samples, n_features).
+        data (np.ndarray | None): The input dataset, shape (n_samples, n_features).
+            May be omitted when both `normal_vector` and `projections` are given.
         normal_vector (Optional[np.ndarray]): An optional normal vector for the hyperplane.
         seed (int): Seed for random number generator for reproducibility.
+        dtype (np.dtype): Dtype of a newly generated normal vector.
+        projections (Optional[np.ndarray]): Precomputed projections of the dataset
+            onto `normal_vector`.
+        b_strategy (str): How the offset is computed, see `compute_offset`.
+        offset (Optional[float]): A precomputed offset, e.g. the median kept by a
+            quantile sketch. `data` and `projections` are then not needed.
+        family (str): Family of a newly generated normal vector, see
+            `generate_normal`.
     Returns:
         tuple[np.ndarray, float]: A tuple containing the normal vector and offset of the hyperplane
     """
     rng = rng if rng is not None else np.random.default_rng()
-    n_features = data.shape[1]
+    if normal_vector is None or (projections is None and offset is None):
+        if data is None:
+            raise ValueError("data is required to generate a normal or projections.")
+
     normal = (
-        normal_vector if normal_vector is not None else generate_normal(n_features, rng)
+        normal_vector
+        if normal_vector is not None
+        else generate_normal(data.shape[1], rng, dtype=dtype, family=family)  # type: ignore
     )
 
-    projections = np.dot(data, normal)
-    offset = np.median(projections)
+    if offset is None:
+        if projections is None:
+            projections = project(data, normal)  # type: ignore
+        offset = compute_offset(projections, b_strategy=b_strategy, rng=rng)
 
     return Hyperplane(normal=normal, offset=offset)
 
 
+def compute_offset(
+    projections: np.ndarray,
+    b_strategy: str = "default",
+    rng: np.random.Generator | None = None,
+    sample_size: int = 1024,
+) -> float:
+    """
+    Compute the offset of a hyperplane that approximately bisects the projections.
+    Args:
+        projections (np.ndarray): Projections of the data points, shape (n_samples,).
+        b_strategy (str): "default" takes the median, "exact" the upper median found
+            with a single `np.partition`, and "sampled" the upper median of at most
+            `sample_size` projections drawn with replacement. "sketch" has no data
+            to work from here and falls back to "exact".
+        rng (np.random.Generator | None): Random number generator for sampling.
+        sample_size (int): Number of projections drawn by the "sampled" strategy.
+    Returns:
+        float: The offset.
+    """
+    n_samples = projections.shape[0]
+
+    if b_strategy == "sampled" and n_samples > sample_size:
+        rng = rng if rng is not None else np.random.default_rng()
+        projections = projections[rng.integers(0, n_samples, size=sample_size)]
+        n_samples = sample_size
+    elif b_strategy not in ("exact", "sampled", "sketch"):
+        return np.median(projections)
+
+    k = n_samples // 2
+    return np.partition(projections, k)[k]
+
+
 def generate_normal(
-    n_features: int, rng: np.random.Generator | None = None
-) -> np.ndarray:
+    n_features: int,
+    rng: np.random.Generator | None = None,
+    dtype: np.dtype | type = np.float64,
+    family: Literal["gaussian", "sparse"] = "gaussian",
+) -> np.ndarray | sp.csr_array:
     """
     Generate a random normal vector for a hyperplane.
+
+    The "sparse" family draws a very sparse random projection (Li et al.): each
+    coordinate is +1 or -1 with probability 1 / (2 sqrt(n_features)) each and 0
+    otherwise. The normal is returned as a (1, n_features) CSR row whose indices
+    and data are the nonzero coordinates and their signs, so projecting onto it
+    only touches about sqrt(n_features) coordinates.
     Args:
         n_features (int): The number of features (dimensions).
         seed (int): Seed for random number generator for reproducibility.
+        dtype (np.dtype): Dtype of the returned vector.
+        family (str): "gaussian" for a dense Gaussian vector or "sparse".
     Returns:
-        np.ndarray: A random normal vector of shape (n_features,).
+        np.ndarray | sp.csr_array: A random normal vector of shape (n_features,),
+        or a (1, n_features) CSR row for the "sparse" family.
     """
     rng = rng if rng is not None else np.random.default_rng()
-    normal = rng.normal(size=n_features)
-    return normal
+    if family == "gaussian":
+        return rng.normal(size=n_features).astype(dtype, copy=False)
+    elif family != "sparse":
+        raise ValueError(f"Unknown normal family: {family}")
+
+    n_nonzero = max(1, rng.binomial(n_features, 1 / np.sqrt(n_features)))
+    indices = np.sort(rng.choice(n_features, size=n_nonzero, replace=False))
+    signs = rng.choice(np.array([-1, 1], dtype=dtype), size=n_nonzero)
+
+    return sp.csr_array(
+        (signs, indices, np.array([0, n_nonzero])), shape=(1, n_features)
+    )
+
+
+def project(data: np.ndarray, normal: np.ndarray | sp.csr_array) -> np.ndarray:
+    """
+    Project data points onto a normal vector.
+    Args:
+        data (np.ndarray): Data points, shape (n_samples, n_features), dense or CSR.
+        normal (np.ndarray | sp.csr_array): A dense normal or a sparse (1, n_features)
+            row, in which case only its nonzero coordinates are read.
+    Returns:
+        np.ndarray: The projections, shape (n_samples,).
+    """
+    if sp.issparse(normal):
+        return data[:, normal.indices] @ normal.data  # type: ignore
+    return data @ normal
+
+
+def stack_normals(
+    normals: np.ndarray | sp.csr_array, new_normals: np.ndarray | sp.csr_array
+) -> np.ndarray | sp.csr_array:
+    """
+    Append normals to the (depth, n_features) normals of a tree.
+    """
+    if normals.shape[0] == 0:
+        return new_normals.reshape(1, -1) if new_normals.ndim == 1 else new_normals
+    elif sp.issparse(normals):
+        return sp.vstack([normals, new_normals], format="csr")
+    return np.vstack([normals, new_normals])
@@ -5,30 +5,54 @@ from numba import njit, prange
 from prodr.ensemble.components import FlatTree, Node
 
 
-def traverse_to_leaf(flat_tree: FlatTree, projections: np.ndarray) -> list[Node]:
+def traverse_to_leaf(
+    flat_tree: FlatTree, projections: np.ndarray, parallel: bool = True
+) -> list[Node]:
     """
     Traverse the flattened tree to find the appropriate leaf nodes for given data points.
 
     Args:
         flat_tree (FlatTree): The flattened tree representation.
         projections (np.ndarray): The projections of the data points onto the normal vectors.
+        parallel (bool): Whether to parallelize over data points with numba threads.
+
+    Returns:
+        list[Node]: The leaf node of each data point.
+    """
+    leaf_ids = traverse_to_leaf_ids(flat_tree, projections, parallel=parallel)
+    return _leaf_ids_to_Node(flat_tree, leaf_ids)
+
+
+def traverse_to_leaf_ids(
+    flat_tree: FlatTree, projections: np.ndarray, parallel: bool = True
+) -> np.ndarray:
+    """
+    Traverse the flattened tree and return leaf node IDs only, skipping the
+    lookup of Node objects.
+
+    The serial kernel releases the GIL, so it is the one to use when trees are
+    already traversed concurrently from a thread pool.
+
+    Args:
+        flat_tree (FlatTree): The flattened tree representation.
+        projections (np.ndarray): The projections of the data points onto the normal vectors.
+        parallel (bool): Whether to parallelize over data points with numba threads.
 
     Returns:
         np.ndarray: An array of leaf node IDs corresponding to each data point.
     """
-    leaf_ids = _traverse_to_leaf(
+    kernel = _traverse_to_leaf if parallel else _traverse_to_leaf_serial
+    return kernel(
         projections,
-        np.array(flat_tree.left, dtype=np.int64),
-        np.array(flat_tree.right, dtype=np.int64),
-        np.array(flat_tree.thresholds, dtype=np.float64),
-        np.array(flat_tree.depth, dtype=np.int64),
+        flat_tree.left,
+        flat_tree.right,
+        flat_tree.thresholds,
+        flat_tree.depth,
         flat_tree.root_id,
     )
-    return _leaf_ids_to_Node(flat_tree, leaf_ids)
 
 
-@njit(parallel=True)
-def _traverse_to_leaf(
+def _traverse_to_leaf_py(
     projections: np.ndarray,
     left: np.ndarray,
     right: np.ndarray,
@@ -58,6 +82,10 @@ def _traverse_to_leaf(
     return leaf_ids
 
 
+_traverse_to_leaf = njit(parallel=True)(_traverse_to_leaf_py)
+_traverse_to_leaf_serial = njit(nogil=True)(_traverse_to_leaf_py)
+
+
 def _leaf_ids_to_Node(flat_tree: FlatTree, leaf_ids: np.ndarray) -> list[Node]:
     """
     Convert an array of leaf node IDs to their corresponding Node objects.
@@ -69,4 +97,4 @@ def _leaf_ids_to_Node(flat_tree: FlatTree, leaf_ids: np.ndarray) -> list[Node]:
     Returns:
         list[Node]: A list of Node objects corresponding to the leaf IDs.
     """
-    return [flat_tree.id_to_node[leaf_id] for leaf_id in leaf_ids]
+    return [flat_tree.id_to_node[leaf_id] for leaf_id in leaf_ids]  # type: ignore